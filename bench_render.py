@@ -0,0 +1,202 @@
+# 渲染性能基准：在 tools/test.md 和 articles/ 下的文章上测量 md.WxRenderer.render 与代码高亮，
+# 输出吞吐、p50/p99 延迟和峰值内存，结果保存为 JSON 以便比较不同版本的渲染器。
+# 用法：python bench_render.py [--scales 1 10 100] [--rounds 30] [--output results.json]
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import markdown
+import pygments
+
+import md
+from node_renderer import percentile
+
+CORPUS_PATTERNS = ['tools/test.md', 'articles/**/*.md']
+FENCED_CODE_RE = re.compile(r'^```[\w+-]*\n[\s\S]*?\n```$', re.MULTILINE)
+FRONT_MATTER_RE = re.compile(r'^---\n.*?\n---\n', re.DOTALL)
+
+
+def load_corpus(patterns=CORPUS_PATTERNS):
+    """读取语料，去掉文章头部的 YAML 元数据"""
+    texts = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            with open(path, 'r', encoding='utf-8') as f:
+                texts.append(FRONT_MATTER_RE.sub('', f.read(), count=1))
+    if not texts:
+        raise SystemExit(f"No corpus found for {patterns}")
+    return '\n\n'.join(texts)
+
+
+def code_heavy(corpus):
+    """代码密集变体：语料中的代码块之间只隔一句说明"""
+    blocks = FENCED_CODE_RE.findall(corpus)
+    if not blocks:
+        with open(md.__file__, 'r', encoding='utf-8') as f:
+            source = f.read()
+        blocks = [f"```python\n{chunk}\n```" for chunk in source.split('\n\n\n')[:20]]
+    return '\n\n'.join(f"第 {i + 1} 段代码：\n\n{block}" for i, block in enumerate(blocks))
+
+
+def table_heavy(corpus, tables=20, rows=12):
+    """表格密集变体：带行内格式的多列表格"""
+    words = re.findall(r'[A-Za-z_]{3,}|[一-鿿]{2,4}', corpus) or ['cell']
+    parts = []
+    for t in range(tables):
+        header = "| 名称 | 类型 | 默认值 | 说明 | 备注 |\n|:--|:--:|--:|:--|:--|"
+        lines = [header]
+        for r in range(rows):
+            word = words[(t * rows + r) % len(words)]
+            lines.append(f"| `{word}` | **str** | {r * t} | {word} 的说明文字 | [链接](https://example.com/{r}) |")
+        parts.append(f"### 表 {t + 1}\n\n" + '\n'.join(lines))
+    return '\n\n'.join(parts)
+
+
+def scaled(text, scale):
+    """
+    把语料重复 scale 次
+
+    从第二份起在每个代码块末尾加一行编号，各份的代码互不相同，
+    否则重复的代码块在一次渲染中就会命中高亮缓存，放大后测到的不是冷渲染。
+    """
+    copies = [text]
+    for i in range(1, scale):
+        copies.append(FENCED_CODE_RE.sub(lambda m: f"{m.group(0)[:-len('```')]}copy_{i}\n```", text))
+    return '\n\n'.join(copies)
+
+
+def clear_caches():
+    """清掉高亮和块缓存，每次都测量冷渲染"""
+    with md._highlight_lock:
+        md._highlight_cache.clear()
+    with md._block_lock:
+        md._block_cache.clear()
+
+
+def measure(func, arg, rounds, size):
+    """
+    :param func: 被测函数
+    :param arg: 传给 func 的参数
+    :param rounds: 计时的运行次数
+    :param size: 输入大小（字节），用于计算吞吐
+    :return: 统计结果
+    """
+    clear_caches()
+    func(arg)  # 预热：初始化 Markdown 实例、lexer、代码主题
+
+    latencies = []
+    for _ in range(rounds):
+        clear_caches()
+        begin = time.perf_counter()
+        func(arg)
+        latencies.append(time.perf_counter() - begin)
+
+    # 峰值内存单独测一次，tracemalloc 会拖慢计时
+    clear_caches()
+    tracemalloc.start()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(latencies)
+    return {
+        'rounds': rounds,
+        'input_bytes': size,
+        'throughput_mb_s': round(size * rounds / total / 1e6, 3),
+        'docs_per_sec': round(rounds / total, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'peak_memory_mb': round(peak / 1e6, 3),
+    }
+
+
+def highlight_all(blocks):
+    style = md.code_theme_styles(md.opts['code_theme'])[0]
+    for lang, code in blocks:
+        md.inline_highlight(code, md.resolve_lexer(lang), style)
+
+
+def extract_code(text):
+    blocks = []
+    for block in FENCED_CODE_RE.findall(text):
+        header, _, body = block.partition('\n')
+        blocks.append((header[3:] or None, body[:-len('\n```')]))
+    return blocks
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales, rounds):
+    corpus = load_corpus()
+    variants = {
+        'article': corpus,
+        'code_heavy': code_heavy(corpus),
+        'table_heavy': table_heavy(corpus),
+    }
+    renderer = md.get_renderer()
+
+    results = []
+    for variant, text in variants.items():
+        for scale in scales:
+            document = scaled(text, scale)
+            size = len(document.encode('utf-8'))
+            # 大文档少跑几次，保证总耗时可控
+            scaled_rounds = max(3, rounds // scale)
+            cases = [('render', renderer.render, document, size)]
+            code = extract_code(document)
+            if code:
+                # 高亮的吞吐按代码本身的大小计算
+                code_size = sum(len(body.encode('utf-8')) for _, body in code)
+                cases.append(('highlight', highlight_all, code, code_size))
+            for target, func, arg, size in cases:
+                result = measure(func, arg, scaled_rounds, size)
+                result.update({'target': target, 'variant': variant, 'scale': scale})
+                results.append(result)
+                print(f"{target:>9} {variant:>11} {scale:>4}x  {result['throughput_mb_s']:>8} MB/s  "
+                      f"p50 {result['p50_ms']:>9} ms  p99 {result['p99_ms']:>9} ms  "
+                      f"peak {result['peak_memory_mb']:>8} MB")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark md.WxRenderer rendering")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--rounds', type=int, default=30, help="1x 语料的运行次数，放大 N 倍时为 rounds / N")
+    parser.add_argument('--output', help="结果 JSON 路径，默认 bench_results/render-<时间>.json")
+    args = parser.parse_args()
+
+    started = datetime.now()
+    results = run(args.scales, args.rounds)
+    report = {
+        'timestamp': started.isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'markdown': markdown.__version__,
+        'pygments': pygments.__version__,
+        'results': results,
+    }
+
+    output = args.output or os.path.join('bench_results', f"render-{started.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
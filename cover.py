@@ -5,8 +5,14 @@ import os
 from PIL import Image
 import io
 import json
+import math
+import random
+import time
+import threading
 import yaml
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from cover_index import PhashIndex, TagIndex, accent_color, dominant_colors, phash
 
 # 读取配置文件
 def load_config():
@@ -15,34 +21,86 @@ def load_config():
 
 config = load_config()
 UNSPLASH_KEY = config['UNSPLASH_KEY']
+COVER_CONFIG = config.get('cover', {}) or {}
 
 # 设置保存图片的目录
 COVER_DIR = "wechat_covers"
 LOG_FILE = os.path.join(f"{COVER_DIR}/photo_log.json")
-MAX_FILE_SIZE = 4 * 1024 * 1024  # 4MB in bytes
+REJECTED_FILE = os.path.join(COVER_DIR, "rejected_photos.json")  # 因近似重复被拒绝的照片 ID
+MASTER_DIR = os.path.join(COVER_DIR, "masters")
 MAX_RESOLUTION = (3840, 2160)  # 4K resolution
+MAX_DOWNLOAD_SIZE = 8 * 1024 * 1024  # 单张照片下载上限
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
-# 上传 URL
-UPLOAD_URL = "https://tg.sciproxy.com/"
+# 封面衍生图尺寸，下载的源图只需略大于其中最大的一张
+LARGE_COVER_SIZE = (900, 383)
+SMALL_COVER_SIZE = (200, 200)
+SOURCE_MARGIN = 1.1
+SOURCE_QUALITY = 85
+
+# 目标大小编码时可选的 JPEG 质量，从低到高
+JPEG_QUALITY_STEPS = list(range(20, 96, 5))
+
+UNSPLASH_RANDOM_URL = "https://api.unsplash.com/photos/random"
+UNSPLASH_RATE_WINDOW = 3600  # Unsplash 按小时重置请求配额
+REQUEST_TIMEOUT = 30
+
+# 后台预取配置
+PREFETCH_LOW_WATER = COVER_CONFIG.get('prefetch_low_water', 5)  # 未使用封面的最低数量
+PREFETCH_BATCH_SIZE = COVER_CONFIG.get('prefetch_batch_size', 3)
+PREFETCH_WORKERS = COVER_CONFIG.get('prefetch_workers', 3)
+PREFETCH_MIN_INTERVAL = COVER_CONFIG.get('prefetch_min_interval', 90)  # 两次 API 调用的最小间隔（秒）
+PREFETCH_MAX_BACKOFF = COVER_CONFIG.get('prefetch_max_backoff', 1800)
+PREFETCH_WAIT_TIMEOUT = COVER_CONFIG.get('prefetch_wait_timeout', 120)  # 封面池为空时等待预取的最长时间
+PROCESS_WORKERS = COVER_CONFIG.get('process_workers', os.cpu_count() or 2)
+
+# 感知哈希汉明距离不超过该值视为近似重复
+DUPLICATE_DISTANCE = COVER_CONFIG.get('duplicate_distance', 8)
+RECENT_COVERS = COVER_CONFIG.get('recent_covers', 10)
+
+# 照片日志会被后台预取线程和发布流程同时读写
+_log_lock = threading.RLock()
 
 def create_directories():
     if not os.path.exists(COVER_DIR):
         os.makedirs(COVER_DIR)
+    if not os.path.exists(MASTER_DIR):
+        os.makedirs(MASTER_DIR)
 
-def optimize_image(image, max_size):
-    quality = 95
-    while True:
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='JPEG', quality=quality)
-        if img_byte_arr.tell() <= max_size or quality <= 20:
-            break
-        quality -= 5
-    return Image.open(img_byte_arr)
+def open_draft(content, size):
+    """
+    打开图片；JPEG 使用 draft 模式，直接按 1/2、1/4、1/8 的比例解码，
+    解码结果不小于 size，省去全分辨率解码的时间和内存
+    """
+    image = Image.open(io.BytesIO(content))
+    if image.format == 'JPEG':
+        image.draft('RGB', size)
+    return image
 
-def merge_covers(large_cover_path, small_cover_path, output_path, gap=20):
-    large_cover = Image.open(large_cover_path)
-    small_cover = Image.open(small_cover_path)
+def encode_jpeg(image, quality):
+    img_byte_arr = io.BytesIO()
+    image.save(img_byte_arr, format='JPEG', quality=quality)
+    return img_byte_arr.getvalue()
+
+def encode_to_size(image, max_size):
+    """二分查找不超过 max_size 的最高质量，约 4 次编码；都超出时返回最低质量的结果"""
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    best = None
+    low, high = 0, len(JPEG_QUALITY_STEPS) - 1
+    while low <= high:
+        middle = (low + high) // 2
+        data = encode_jpeg(image, JPEG_QUALITY_STEPS[middle])
+        if len(data) <= max_size:
+            best = data
+            low = middle + 1
+        else:
+            high = middle - 1
 
+    return best if best is not None else encode_jpeg(image, JPEG_QUALITY_STEPS[0])
+
+def compose_covers(large_cover, small_cover, gap=20):
     large_width, large_height = large_cover.size
     small_width, small_height = small_cover.size
 
@@ -57,9 +115,7 @@ def merge_covers(large_cover_path, small_cover_path, output_path, gap=20):
     new_image.paste(large_cover, large_position)
     new_image.paste(small_cover, small_position)
 
-    new_image.save(output_path, 'PNG')
-
-    return {
+    return new_image, {
         'large_cover': {
             'position': large_position,
             'size': large_cover.size
@@ -85,59 +141,91 @@ def crop_and_resize(img, target_width, target_height):
     
     return img.resize((target_width, target_height), Image.LANCZOS)
 
-def create_wechat_covers(img, photo_id):
-    cover_large = crop_and_resize(img, 900, 383)
-    large_cover_path = os.path.join(COVER_DIR, f"{photo_id}_900x383.jpg")
-    cover_large.save(large_cover_path, 'JPEG', quality=95)
-
-    cover_small = crop_and_resize(img, 200, 200)
-    small_cover_path = os.path.join(COVER_DIR, f"{photo_id}_200x200.jpg")
-    cover_small.save(small_cover_path, 'JPEG', quality=95)
-
-    return large_cover_path, small_cover_path
+def cover_source_size(content):
+    """读取图片头，计算裁剪所有封面所需的最小解码尺寸"""
+    with Image.open(io.BytesIO(content)) as image:
+        width, height = image.size
+    source_width = source_width_for(width, height) / SOURCE_MARGIN
+    return math.ceil(source_width), math.ceil(source_width * height / width)
 
-def upload_image(image):
-    img_byte_arr = io.BytesIO()
-    image.save(img_byte_arr, format='JPEG')
-    img_byte_arr.seek(0)
-    files = {'file': ('image.jpg', img_byte_arr, 'image/jpeg')}
-    response = requests.post(UPLOAD_URL, files=files)
-    if response.status_code == 200:
-        upload_info = json.loads(response.text)
-        return upload_info[0]['src']
-    else:
-        print(f"Failed to upload image")
-        return None
+def build_cover(content, photo_id):
+    """
+    在内存中完成裁剪、缩放和拼接：源图只解码一次，只写一次最终的 PNG
 
-def process_and_upload_image(url, photo_id):
-    response = requests.get(url)
-    if response.status_code == 200:
-        image = Image.open(io.BytesIO(response.content))
-        
+    :param content: 源图的字节内容
+    :param photo_id: 照片 ID，用于命名输出文件
+    :return: (封面路径, 裁剪信息, 图片特征)
+    """
+    with open_draft(content, cover_source_size(content)) as image:
+        image = image.convert('RGB')
         if image.size[0] > MAX_RESOLUTION[0] or image.size[1] > MAX_RESOLUTION[1]:
             image.thumbnail(MAX_RESOLUTION)
-        
-        if len(response.content) > MAX_FILE_SIZE:
-            image = optimize_image(image, MAX_FILE_SIZE)
-        
-        large_cover_path, small_cover_path = create_wechat_covers(image, photo_id)
-        # try:
-        #     upload_url = upload_image(image)
-        # except Exception as e:
-        #     print(f"Failed to upload image: {e}")
-        #     return False, None, None, None
-        #
-        # if upload_url:
-        #     print(f"Uploaded image successfully")
-        #     return True, upload_url, large_cover_path, small_cover_path
-        # else:
-        #     return False, None, None, None
-        return True, large_cover_path, small_cover_path
-    else:
-        print(f"Failed to download: {url}")
-        return False, None, None, None
-
-def log_photo(photo_id, upload_url, large_cover_path, small_cover_path, crop_info, output_path):
+
+        cover_large = crop_and_resize(image, *LARGE_COVER_SIZE)
+        cover_small = crop_and_resize(image, *SMALL_COVER_SIZE)
+        colors = dominant_colors(image)
+        features = {
+            "phash": f"{phash(image):016x}",
+            "dominant_colors": colors,
+            "accent_color": accent_color(colors),
+        }
+
+    merged, crop_info = compose_covers(cover_large, cover_small)
+    output_path = os.path.join(COVER_DIR, f"{photo_id}_covers.png")
+    merged.save(output_path, 'PNG')
+    return output_path, crop_info, features
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool():
+    """封面处理是 CPU 密集型的，放到进程池里并行处理多张照片"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS)
+        return _process_pool
+
+def source_width_for(photo_width, photo_height):
+    """计算居中裁剪出所有封面尺寸所需的最小源图宽度"""
+    ratio = photo_width / photo_height if photo_width and photo_height else 1.5
+    width = 0
+    for target_width, target_height in (LARGE_COVER_SIZE, SMALL_COVER_SIZE):
+        # 源图比目标更宽时按高度裁剪，需要高度足够；否则需要宽度足够
+        width = max(width, target_width, target_height * ratio)
+    return min(math.ceil(width * SOURCE_MARGIN), photo_width or MAX_RESOLUTION[0])
+
+def sized_photo_url(photo):
+    """使用 Unsplash 的 raw 地址和尺寸参数，让服务端返回缩放好的 JPEG"""
+    width = source_width_for(photo.get('width'), photo.get('height'))
+    raw_url = photo['urls']['raw']
+    separator = '&' if '?' in raw_url else '?'
+    return f"{raw_url}{separator}w={width}&q={SOURCE_QUALITY}&fm=jpg&fit=max"
+
+def download_image(url, max_size=MAX_DOWNLOAD_SIZE):
+    """流式下载到有界缓冲区，超过 max_size 时中止"""
+    with requests.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code != 200:
+            return None
+        declared = int(response.headers.get('Content-Length') or 0)
+        if declared > max_size:
+            raise ValueError(f"Image too large: {declared} bytes")
+
+        buffer = io.BytesIO()
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            buffer.write(chunk)
+            if buffer.tell() > max_size:
+                raise ValueError(f"Image exceeds {max_size} bytes")
+        return buffer.getvalue()
+
+def save_master(content, photo_id):
+    """保存下载的源图（服务端已缩放），供之后按需生成其他尺寸"""
+    master_path = os.path.join(MASTER_DIR, f"{photo_id}.jpg")
+    with open(master_path, 'wb') as f:
+        f.write(content)
+    return master_path
+
+def log_photo(photo_id, upload_url, large_cover_path, small_cover_path, crop_info, output_path, extra=None):
     log_entry = {
         "photo_id": photo_id,
         "upload_url": upload_url,
@@ -149,36 +237,106 @@ def log_photo(photo_id, upload_url, large_cover_path, small_cover_path, crop_inf
         "article_url": None,
         "timestamp": datetime.now().isoformat()
     }
+    if extra:
+        log_entry.update(extra)
     
-    log_data = read_log()
-    log_data[photo_id] = log_entry
-    
-    with open(LOG_FILE, 'w') as f:
-        json.dump(log_data, f, indent=2)
+    with _log_lock:
+        log_data = read_log()
+        log_data[photo_id] = log_entry
+        write_log(log_data)
 
 def read_log():
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    with _log_lock:
+        if os.path.exists(LOG_FILE):
+            with open(LOG_FILE, 'r') as f:
+                return json.load(f)
+        return {}
+
+def write_log(log_data):
+    # 先写临时文件再替换，避免其他线程读到写了一半的日志
+    tmp_path = f"{LOG_FILE}.tmp"
+    with _log_lock:
+        with open(tmp_path, 'w') as f:
+            json.dump(log_data, f, indent=2)
+        os.replace(tmp_path, LOG_FILE)
 
 def update_photo_usage(photo_id, article_url):
+    with _log_lock:
+        log_data = read_log()
+        if photo_id in log_data:
+            log_data[photo_id]["is_used"] = True
+            log_data[photo_id]["article_url"] = article_url
+            log_data[photo_id]["usage_timestamp"] = datetime.now().isoformat()
+            write_log(log_data)
+            return True
+        return False
+
+_phash_index = None
+
+def get_phash_index():
+    """从照片日志构建感知哈希索引，之后随入库增量更新"""
+    global _phash_index
+    with _log_lock:
+        if _phash_index is None:
+            _phash_index = PhashIndex()
+            for photo_id, data in read_log().items():
+                if data.get("phash"):
+                    _phash_index.add(photo_id, int(data["phash"], 16))
+        return _phash_index
+
+_tag_index = None
+
+def photo_metadata(photo):
+    """保留 Unsplash 返回的描述和标签，用于按主题匹配封面"""
+    tags = photo.get('tags') or photo.get('tags_preview') or []
+    return {
+        "description": photo.get('description'),
+        "alt_description": photo.get('alt_description'),
+        "tags": [tag['title'] if isinstance(tag, dict) else tag for tag in tags],
+    }
+
+def metadata_texts(data):
+    return [data.get("description") or "", data.get("alt_description") or "", *data.get("tags", [])]
+
+def get_tag_index():
+    """从照片日志构建元数据倒排索引，之后随入库增量更新"""
+    global _tag_index
+    with _log_lock:
+        if _tag_index is None:
+            _tag_index = TagIndex()
+            for photo_id, data in read_log().items():
+                _tag_index.add(photo_id, metadata_texts(data))
+        return _tag_index
+
+def recent_used_photos(limit=RECENT_COVERS):
     log_data = read_log()
-    if photo_id in log_data:
-        log_data[photo_id]["is_used"] = True
-        log_data[photo_id]["article_url"] = article_url
-        log_data[photo_id]["usage_timestamp"] = datetime.now().isoformat()
-        with open(LOG_FILE, 'w') as f:
-            json.dump(log_data, f, indent=2)
-        return True
-    return False
+    used = [(data.get("usage_timestamp", ""), photo_id) for photo_id, data in log_data.items() if data["is_used"]]
+    return [photo_id for _, photo_id in sorted(used, reverse=True)[:limit]]
+
+def choose_cover(candidates, query=None):
+    """
+    选择封面：先按文章标题和标签在元数据索引中匹配，再从得分最高的候选中
+    选出与最近使用的封面最不相似的一张
+
+    :param candidates: 候选 photo_id 列表
+    :param query: 文章标题、标签等文本列表
+    """
+    if not candidates:
+        return None
+    if query:
+        scores = get_tag_index().search(query, set(candidates))
+        if scores:
+            best = max(scores.values())
+            candidates = [photo_id for photo_id in candidates if scores.get(photo_id) == best]
+    selected = get_phash_index().least_similar(candidates, recent_used_photos())
+    return selected or random.choice(candidates)
 
 def get_unused_photos():
     log_data = read_log()
     return [photo_id for photo_id, data in log_data.items() if not data["is_used"]]
 
-def get_landscape_photos(count=3):
-    url = "https://api.unsplash.com/photos/random"
+def fetch_landscape_photo_list(count=3):
+    """调用 Unsplash 随机接口，返回照片列表和剩余配额（未知时为 None）"""
     headers = {"Authorization": f"Client-ID {UNSPLASH_KEY}"}
     params = {
         "query": "landscape",
@@ -186,28 +344,229 @@ def get_landscape_photos(count=3):
         "orientation": "landscape"
     }
 
-    response = requests.get(url, headers=headers, params=params)
-    
-    if response.status_code == 200:
-        photos = response.json()
-        for photo in photos:
-            image_url = photo['urls']['full']
-            photo_id = photo['id']
-            try:
-                success, large_cover_path, small_cover_path = process_and_upload_image(image_url, photo_id)
-                output_path = os.path.join(COVER_DIR, f"{photo_id}_covers.png")
-                if success:
-                    crop_info = merge_covers(large_cover_path, small_cover_path, output_path)
-                    log_photo(photo_id, image_url, large_cover_path, small_cover_path, crop_info, output_path)
-                    os.remove(large_cover_path)
-                    os.remove(small_cover_path)
-            except Exception as e:
-                # 打印错误堆栈
-                stacktrace = traceback.format_exc(e)
-                print(stacktrace)
-                print(f"Error processing photo {photo_id}: {e}")
-    else:
-        print(f"API request failed with status code: {response.status_code}")
+    response = requests.get(UNSPLASH_RANDOM_URL, headers=headers, params=params, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    remaining = response.headers.get("X-Ratelimit-Remaining")
+    return response.json(), int(remaining) if remaining is not None else None
+
+_ingesting = set()
+_rejected = None
+
+def get_rejected_photos():
+    """已拒绝的照片 ID，首次调用时从 REJECTED_FILE 读取"""
+    global _rejected
+    with _log_lock:
+        if _rejected is None:
+            _rejected = set()
+            if os.path.exists(REJECTED_FILE):
+                with open(REJECTED_FILE, 'r') as f:
+                    _rejected = set(json.load(f))
+        return _rejected
+
+def reject_photo(photo_id):
+    """记录被拒绝的照片，之后再拉到时不再下载"""
+    with _log_lock:
+        rejected = get_rejected_photos()
+        rejected.add(photo_id)
+        tmp_path = f"{REJECTED_FILE}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(sorted(rejected), f, indent=2)
+        os.replace(tmp_path, REJECTED_FILE)
+
+def claim_photo(photo_id):
+    """登记正在入库的照片；已入库、已被拒绝或正被其他线程处理时返回 False"""
+    with _log_lock:
+        if (photo_id in _ingesting or photo_id in get_rejected_photos() or photo_id in read_log()
+                or photo_id in get_phash_index()):
+            return False
+        _ingesting.add(photo_id)
+        return True
+
+def release_photo(photo_id):
+    with _log_lock:
+        _ingesting.discard(photo_id)
+
+def is_logged_path(path):
+    return any(data.get("cover_path") == path for data in read_log().values())
+
+def ingest_photo(photo):
+    """下载并处理单张照片，成功后写入日志"""
+    try:
+        photo_id = photo['id']
+        image_url = sized_photo_url(photo)
+    except (KeyError, TypeError) as e:
+        print(f"Skipping malformed photo entry, missing {e}")
+        return False
+    # 重复拉到的照片不再下载，否则会覆盖已入库照片的封面文件
+    if not claim_photo(photo_id):
+        print(f"Skipping photo already seen: {photo_id}")
+        return False
+    try:
+        content = download_image(image_url)
+        if content is None:
+            print(f"Failed to download: {image_url}")
+            return False
+
+        output_path, crop_info, features = get_process_pool().submit(build_cover, content, photo_id).result()
+        if not get_phash_index().add_if_unique(photo_id, int(features["phash"], 16), DUPLICATE_DISTANCE):
+            print(f"Skipping near-duplicate photo {photo_id}")
+            reject_photo(photo_id)
+            if not is_logged_path(output_path):
+                os.remove(output_path)
+            return False
+
+        master_path = save_master(content, photo_id)
+        metadata = photo_metadata(photo)
+        log_photo(photo_id, image_url, None, None, crop_info, output_path,
+                  {"master_path": master_path, **features, **metadata})
+        get_tag_index().add(photo_id, metadata_texts(metadata))
+        return True
+    except Exception as e:
+        # 打印错误堆栈
+        traceback.print_exc()
+        print(f"Error processing photo {photo_id}: {e}")
+        return False
+    finally:
+        release_photo(photo_id)
+
+def get_landscape_photos(count=3):
+    create_directories()
+    try:
+        photos, _ = fetch_landscape_photo_list(count)
+    except requests.RequestException as e:
+        print(f"API request failed: {e}")
+        return
+
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as executor:
+        list(executor.map(ingest_photo, photos))
+
+class CoverPrefetcher:
+    """
+    后台封面预取器
+
+    保持未使用封面数量不低于 low_water：低于水位时在后台线程里批量拉取，
+    下载和处理并发进行。两次 API 调用之间至少间隔 min_interval 秒，配额用尽时
+    等到下一个配额窗口，出错时指数退避。
+    """
+
+    def __init__(self, low_water=PREFETCH_LOW_WATER, batch_size=PREFETCH_BATCH_SIZE,
+                 workers=PREFETCH_WORKERS, min_interval=PREFETCH_MIN_INTERVAL,
+                 max_backoff=PREFETCH_MAX_BACKOFF):
+        self.low_water = low_water
+        self.batch_size = batch_size
+        self.workers = workers
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        self._failures = 0
+        self._next_request_at = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._batch_done = threading.Condition()
+        self._batches = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            create_directories()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="cover-prefetcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def poke(self):
+        """封面被消耗后调用，立即检查水位"""
+        self._wakeup.set()
+
+    def wait_for_covers(self, timeout=PREFETCH_WAIT_TIMEOUT):
+        """
+        封面池为空时调用：唤醒预取线程并等待它拉取，不另外发起 API 请求
+
+        :param timeout: 最长等待秒数
+        :return: 是否已有未使用的封面
+        """
+        deadline = time.monotonic() + timeout
+        with self._batch_done:
+            while not get_unused_photos():
+                batches = self._batches
+                self._wakeup.set()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._batch_done.wait_for(lambda: self._batches != batches, remaining):
+                    break
+        return bool(get_unused_photos())
+
+    def deficit(self):
+        return max(self.low_water - len(get_unused_photos()), 0)
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self._stopped.is_set():
+                deficit = self.deficit()
+                if deficit == 0:
+                    self._wakeup.wait(self.min_interval)
+                    self._wakeup.clear()
+                    continue
+
+                delay = self._next_request_at - time.time()
+                if delay > 0:
+                    self._stopped.wait(delay)
+                    continue
+
+                try:
+                    self._fetch_batch(executor, min(max(deficit, self.batch_size), 30))
+                except Exception as e:
+                    # 任何意外错误都只退避，预取线程不能因此退出
+                    traceback.print_exc()
+                    print(f"封面预取失败: {e}")
+                    self._backoff()
+                finally:
+                    with self._batch_done:
+                        self._batches += 1
+                        self._batch_done.notify_all()
+
+    def _fetch_batch(self, executor, count):
+        try:
+            photos, remaining = fetch_landscape_photo_list(count)
+        except requests.RequestException as e:
+            status = getattr(e.response, 'status_code', None)
+            if status in (403, 429):
+                # 配额用尽，等到下一个窗口
+                self._schedule(UNSPLASH_RATE_WINDOW)
+            else:
+                self._backoff()
+            print(f"封面预取失败: {e}")
+            return
+
+        results = list(executor.map(ingest_photo, photos))
+        if photos and not any(results):
+            self._backoff()
+            return
+
+        self._failures = 0
+        self._schedule(UNSPLASH_RATE_WINDOW if remaining == 0 else self.min_interval)
+
+    def _backoff(self):
+        self._failures += 1
+        self._schedule(min(self.min_interval * 2 ** self._failures, self.max_backoff))
+
+    def _schedule(self, delay):
+        self._next_request_at = time.time() + delay
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+def start_prefetcher():
+    """启动（或返回已启动的）全局封面预取器"""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = CoverPrefetcher()
+        return _prefetcher.start()
 
 if __name__ == "__main__":
     create_directories()
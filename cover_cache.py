@@ -0,0 +1,193 @@
+import io
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from PIL import Image
+
+from cover import (
+    COVER_CONFIG, COVER_DIR, MASTER_DIR, compose_covers, crop_and_resize, encode_to_size, open_draft, read_log
+)
+
+DERIVATIVE_DIR = os.path.join(COVER_DIR, "derivatives")
+UPLOAD_DIR = os.path.join(COVER_DIR, "uploads")
+DERIVATIVE_BUDGET = COVER_CONFIG.get('derivative_budget_mb', 200) * 1024 * 1024
+UPLOAD_MAX_BYTES = COVER_CONFIG.get('upload_max_kb', 300) * 1024  # 发布时上传的封面大小上限
+
+FORMAT_EXTENSIONS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+}
+
+
+@dataclass(frozen=True)
+class DerivativeSpec:
+    """衍生图规格：尺寸、格式，以及质量或字节上限（二者取其一）"""
+    width: int
+    height: int
+    format: str = 'JPEG'
+    quality: int = 90
+    max_bytes: Optional[int] = None
+
+    @property
+    def key(self) -> str:
+        target = f"max{self.max_bytes}" if self.max_bytes else f"q{self.quality}"
+        return f"{self.width}x{self.height}_{target}.{FORMAT_EXTENSIONS[self.format]}"
+
+
+# 常用规格
+COVER_235_1 = DerivativeSpec(900, 383)
+COVER_1_1 = DerivativeSpec(200, 200)
+THUMB_64K = DerivativeSpec(360, 153, max_bytes=64 * 1024)  # 微信 thumb 素材上限 64KB
+
+
+def fit_size(image_size, spec: DerivativeSpec):
+    """规格的宽高比在图片中能裁剪出的最大尺寸，不超过规格本身"""
+    width, height = image_size
+    scale = min(1, width / spec.width, height / spec.height)
+    return max(1, int(spec.width * scale)), max(1, int(spec.height * scale))
+
+
+class DerivativeCache:
+    """
+    封面衍生图缓存
+
+    按 (photo_id, 规格) 从保存的源图懒生成，文件修改时间作为最近访问时间，
+    总大小超过 budget 时按 LRU 淘汰。
+    源图是按封面尺寸下载的，规格超出源图可裁剪的范围时按比例缩小，不做放大。
+    """
+
+    def __init__(self, root: str = DERIVATIVE_DIR, budget: int = DERIVATIVE_BUDGET):
+        self.root = root
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._total = None
+
+    def path_for(self, photo_id: str, spec: DerivativeSpec) -> str:
+        return os.path.join(self.root, f"{photo_id}_{spec.key}")
+
+    def get(self, photo_id: str, spec: DerivativeSpec) -> str:
+        """
+        获取衍生图路径，不存在时生成
+
+        :param photo_id: 照片 ID
+        :param spec: 衍生图规格
+        :return: 衍生图的本地路径
+        """
+        path = self.path_for(photo_id, spec)
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)
+                return path
+
+        data = self._render(self._master_path(photo_id), spec)
+
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._scan()
+            self._total += len(data)
+            self._evict(keep=path)
+        return path
+
+    def _master_path(self, photo_id: str) -> str:
+        master_path = read_log().get(photo_id, {}).get('master_path')
+        if not master_path:
+            master_path = os.path.join(MASTER_DIR, f"{photo_id}.jpg")
+        if not os.path.exists(master_path):
+            raise FileNotFoundError(f"Master image not found for photo: {photo_id}")
+        return master_path
+
+    def _render(self, master_path: str, spec: DerivativeSpec) -> bytes:
+        with open(master_path, 'rb') as f:
+            content = f.read()
+
+        with open_draft(content, (spec.width, spec.height)) as image:
+            image = image.convert('RGB')
+            size = fit_size(image.size, spec)
+            if size != (spec.width, spec.height):
+                print(f"Master {master_path} is {image.width}x{image.height}, "
+                      f"{spec.width}x{spec.height} derivative capped at {size[0]}x{size[1]}")
+            image = crop_and_resize(image, *size)
+
+        if spec.format == 'JPEG' and spec.max_bytes:
+            return encode_to_size(image, spec.max_bytes)
+
+        output = io.BytesIO()
+        if spec.format == 'PNG':
+            image.save(output, format='PNG', optimize=True)
+        else:
+            image.save(output, format=spec.format, quality=spec.quality)
+        return output.getvalue()
+
+    def _entries(self):
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.root, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan(self):
+        if self._total is None:
+            self._total = sum(size for _, size, _ in self._entries())
+
+    def _evict(self, keep=None):
+        if self._total <= self.budget:
+            return
+        for _, size, path in sorted(self._entries()):
+            if path == keep:
+                continue
+            os.remove(path)
+            self._total -= size
+            if self._total <= self.budget:
+                break
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_derivative(photo_id: str, spec: DerivativeSpec) -> str:
+    """使用全局缓存获取衍生图路径"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DerivativeCache()
+    return _cache.get(photo_id, spec)
+
+
+def build_upload_cover(photo_id: str, large: DerivativeSpec = COVER_235_1, small: DerivativeSpec = COVER_1_1):
+    """
+    用缓存中的大小两张衍生图拼出发布时上传的封面，布局与 cover.build_cover 相同
+
+    :param photo_id: 照片 ID
+    :return: (封面路径, 裁剪信息)；没有源图时抛出 FileNotFoundError
+    """
+    with Image.open(get_derivative(photo_id, large)) as large_cover, \
+            Image.open(get_derivative(photo_id, small)) as small_cover:
+        merged, crop_info = compose_covers(large_cover.convert('RGB'), small_cover.convert('RGB'))
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DIR, f"{photo_id}_cover.jpg")
+    # 两张图之间的透明间隔变成黑色，不在任何裁剪区域内
+    data = encode_to_size(merged.convert('RGB'), UPLOAD_MAX_BYTES)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path, crop_info
+
+
+if __name__ == "__main__":
+    import sys
+    photo_id = sys.argv[1]
+    for spec in (COVER_235_1, COVER_1_1, THUMB_64K):
+        print(spec.key, get_derivative(photo_id, spec))
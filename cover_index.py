@@ -0,0 +1,232 @@
+import math
+import re
+import threading
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def phash(image):
+    """
+    计算 64 位感知哈希（DCT pHash）
+
+    :param image: PIL 图片
+    :return: 哈希值（int）
+    """
+    pixels = np.asarray(image.convert('L').resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # 直流分量不参与中位数计算
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def _popcount(values):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8)).reshape(*values.shape, 64).sum(axis=-1)
+
+
+class PhashIndex:
+    """
+    感知哈希索引
+
+    哈希存放在连续的 uint64 数组里，汉明距离用 XOR + popcount 向量化计算，
+    封面池增长到上千张时查重和选图仍然是一次数组运算。
+    """
+
+    def __init__(self):
+        self._ids = []
+        self._positions = {}
+        self._hashes = np.empty(64, dtype=np.uint64)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, photo_id):
+        return photo_id in self._positions
+
+    def _add(self, photo_id, value):
+        if photo_id in self._positions:
+            self._hashes[self._positions[photo_id]] = value
+            return
+        if len(self._ids) == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.empty(len(self._hashes), dtype=np.uint64)])
+        self._positions[photo_id] = len(self._ids)
+        self._hashes[len(self._ids)] = value
+        self._ids.append(photo_id)
+
+    def add(self, photo_id, value):
+        with self._lock:
+            self._add(photo_id, value)
+
+    def distances(self, value):
+        """返回 value 与索引中所有哈希的汉明距离"""
+        hashes = self._hashes[:len(self._ids)]
+        return _popcount(hashes ^ np.uint64(value))
+
+    def nearest(self, value):
+        """返回 (photo_id, 距离)，索引为空时返回 (None, None)"""
+        with self._lock:
+            if not self._ids:
+                return None, None
+            distances = self.distances(value)
+            position = int(np.argmin(distances))
+            return self._ids[position], int(distances[position])
+
+    def add_if_unique(self, photo_id, value, threshold):
+        """索引中没有距离不超过 threshold 的哈希时加入，返回是否加入"""
+        with self._lock:
+            if self._ids and int(self.distances(value).min()) <= threshold:
+                return False
+            self._add(photo_id, value)
+            return True
+
+    def least_similar(self, candidates, references):
+        """
+        从 candidates 中选出与 references 最不相似的一张
+
+        :param candidates: 候选 photo_id 列表
+        :param references: 参照 photo_id 列表（如最近使用过的封面）
+        :return: photo_id；候选都不在索引中时返回 None
+        """
+        with self._lock:
+            candidate_ids = [c for c in candidates if c in self._positions]
+            reference_positions = [self._positions[r] for r in references if r in self._positions]
+            if not candidate_ids:
+                return None
+            if not reference_positions:
+                return candidate_ids[0]
+
+            candidate_hashes = self._hashes[[self._positions[c] for c in candidate_ids]]
+            reference_hashes = self._hashes[reference_positions]
+            distances = _popcount(candidate_hashes[:, None] ^ reference_hashes[None, :])
+            return candidate_ids[int(np.argmax(distances.min(axis=1)))]
+
+
+def dominant_colors(image, count=5, bits=4):
+    """
+    向量化颜色量化，提取主色
+
+    每个通道保留高 bits 位作为颜色桶，用 bincount 统计桶内像素数和颜色均值。
+
+    :param image: PIL 图片
+    :param count: 返回的主色数量
+    :param bits: 每个通道的量化位数
+    :return: [{"color": "#rrggbb", "ratio": 占比}, ...]，按占比降序
+    """
+    pixels = np.asarray(image.convert('RGB').resize((64, 64)), dtype=np.int64).reshape(-1, 3)
+    shift = 8 - bits
+    bins = (pixels[:, 0] >> shift) << (2 * bits) | (pixels[:, 1] >> shift) << bits | (pixels[:, 2] >> shift)
+    size = 1 << (3 * bits)
+    counts = np.bincount(bins, minlength=size)
+    sums = np.stack([np.bincount(bins, weights=pixels[:, c], minlength=size) for c in range(3)], axis=1)
+
+    top = np.argsort(counts)[::-1][:count]
+    top = top[counts[top] > 0]
+    means = np.rint(sums[top] / counts[top, None]).astype(int)
+    ratios = counts[top] / len(bins)
+    return [
+        {"color": "#{:02x}{:02x}{:02x}".format(*mean), "ratio": round(float(ratio), 4)}
+        for mean, ratio in zip(means, ratios)
+    ]
+
+
+def accent_color(colors, alpha=0.9):
+    """
+    从主色中挑选适合做强调色的颜色
+
+    强调色会用作标题背景（白字）和边框，所以只考虑明度适中的颜色，
+    并按饱和度和占比打分；没有合适的颜色时把最主要的颜色压暗使用。
+
+    :param colors: dominant_colors 的返回值
+    :return: "rgba(r, g, b, alpha)"，colors 为空时返回 None
+    """
+    if not colors:
+        return None
+    rgb = np.array([[int(c["color"][i:i + 2], 16) for i in (1, 3, 5)] for c in colors], dtype=np.float64) / 255
+    ratios = np.array([c["ratio"] for c in colors])
+    high, low = rgb.max(axis=1), rgb.min(axis=1)
+    lightness = (high + low) / 2
+    saturation = np.where(high == low, 0, (high - low) / (1 - np.abs(2 * lightness - 1) + 1e-9))
+
+    scores = saturation * np.sqrt(ratios)
+    scores[(lightness < 0.25) | (lightness > 0.6)] = -1
+    best = int(np.argmax(scores))
+    chosen = rgb[best]
+    if scores[best] < 0:
+        chosen = rgb[0] * min(1, 0.45 / max(lightness[0], 1e-9))
+
+    r, g, b = (int(round(v * 255)) for v in chosen)
+    return f"rgba({r}, {g}, {b}, {alpha})"
+
+
+_WORD_RE = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]+")
+STOPWORDS = {"a", "an", "and", "the", "of", "in", "on", "at", "to", "with", "for", "by", "from", "is", "are"}
+
+
+def tokenize(text):
+    """英文按单词切分，中文按相邻两字切分（单字保留原字）"""
+    tokens = []
+    for word in _WORD_RE.findall((text or "").lower()):
+        if word[0] >= "\u4e00":
+            tokens.extend([word] if len(word) == 1 else [word[i:i + 2] for i in range(len(word) - 1)])
+        elif len(word) > 1 and word not in STOPWORDS:
+            tokens.append(word)
+    return tokens
+
+
+class TagIndex:
+    """
+    封面元数据倒排索引
+
+    把照片的描述、alt 描述和标签切词后建立 词 -> photo_id 的倒排表，
+    按文章标题和标签选封面时只需一次本地查询，不用再请求 Unsplash 搜索接口。
+    """
+
+    def __init__(self):
+        self._postings = defaultdict(set)
+        self._photos = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._photos)
+
+    def add(self, photo_id, texts):
+        with self._lock:
+            self._photos.add(photo_id)
+            for token in set(token for text in texts for token in tokenize(text)):
+                self._postings[token].add(photo_id)
+
+    def search(self, query, candidates=None):
+        """
+        :param query: 查询文本列表（标题、标签等）
+        :param candidates: 只在这些 photo_id 中查找，None 表示全部
+        :return: {photo_id: 得分}，得分为命中词的 IDF 之和
+        """
+        scores = defaultdict(float)
+        with self._lock:
+            total = len(self._photos)
+            for token in set(token for text in query for token in tokenize(text)):
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                weight = math.log(1 + total / len(postings))
+                for photo_id in postings if candidates is None else postings & candidates:
+                    scores[photo_id] += weight
+        return dict(scores)
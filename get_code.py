@@ -1,11 +1,42 @@
-import base64
-from playwright.sync_api import sync_playwright
-import tempfile
+import asyncio
+import atexit
+import hashlib
+import html
 import os
-from PIL import Image
+import re
+import shutil
+import threading
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+import numpy as np
+from playwright.async_api import async_playwright
+from playwright.sync_api import sync_playwright, Error as PlaywrightError
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name, TextLexer
+from pygments.style import Style
+from pygments.token import Token, Comment, Keyword, Name, String, Number, Operator, Generic
+from pygments.util import ClassNotFound
 import io
 import textwrap
 
+def load_config():
+    # 单独运行本模块时可以没有配置文件
+    if not os.path.exists('config.yaml'):
+        return {}
+    with open('config.yaml', 'r') as file:
+        return yaml.safe_load(file) or {}
+
+CODE_IMAGE_CONFIG = load_config().get('code_image', {}) or {}
+CODE_IMAGE_BACKEND = CODE_IMAGE_CONFIG.get('backend', 'browser')  # browser 或 pillow
+CODE_BLOCK_MODE = CODE_IMAGE_CONFIG.get('mode', 'image')  # image 渲染成图片，inline 保留代码块由 md.py 输出高亮样式
+CODE_CACHE_DIR = CODE_IMAGE_CONFIG.get('cache_dir', 'code_cache')
+THEME_NAME = 'editor-dark'
+CONCURRENCY = CODE_IMAGE_CONFIG.get('concurrency', 4)  # 异步渲染时同时使用的页面数
+
 def format_code(code, max_width=80):
     lines = code.split('\n')
     formatted_lines = []
@@ -18,144 +49,802 @@ def format_code(code, max_width=80):
             formatted_lines.append(line)
     return '\n'.join(formatted_lines)
 
-def code_to_png(code, language, save_path, max_width=80):
+class EditorStyle(Style):
+    """代码图片的高亮配色（atom-one-dark 加上模板原有的颜色覆盖）"""
+    background_color = 'transparent'
+    styles = {
+        Token: '#FFFFFF',
+        Comment: 'italic #5C6370',
+        Keyword: '#FF7AB2',
+        Keyword.Constant: '#D19A66',
+        Name.Builtin: '#78C2B3',
+        Name.Function: '#78C2B3',
+        Name.Class: '#E5C07B',
+        Name.Decorator: '#61AEEE',
+        Name.Tag: '#E06C75',
+        Name.Attribute: '#D19A66',
+        String: '#FF8170',
+        Number: '#D9C97C',
+        Operator: '#56B6C2',
+        Generic.Deleted: '#E06C75',
+        Generic.Inserted: '#98C379',
+    }
+
+# 高亮在 Python 端用 Pygments 完成，页面不依赖任何外部脚本或样式表
+HIGHLIGHT_CSS = HtmlFormatter(style=EditorStyle).get_style_defs('.code-content')
+_formatter = HtmlFormatter(style=EditorStyle, nowrap=True)
+
+def resolve_lexer(language):
+    try:
+        return get_lexer_by_name(language)
+    except ClassNotFound:
+        return TextLexer()
+
+def highlight_code(code, language, max_width=80):
+    """返回放入 .code-content 的高亮 HTML"""
     formatted_code = format_code(code, max_width)
-    
-    HTML_TEMPLATE = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Code Preview</title>
-        <style>
-            body {{
-                margin: 0;
-                padding: 0;
-                background: linear-gradient(135deg, #b388ff 0%, #7c4dff 100%);
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                min-height: 100vh;
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Roboto', 'Helvetica', 'Arial', sans-serif;
-            }}
-            .editor-container {{
-                background-color: rgba(41, 42, 48, 0.85);
-                border-radius: 12px;
-                overflow: hidden;
-                box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
-                width: 720px;
-                margin: 40px;
-            }}
-            .window-controls {{
-                background-color: rgba(58, 58, 58, 0.85);
-                padding: 10px;
-                display: flex;
-                align-items: center;
-            }}
-            .control {{
-                width: 12px;
-                height: 12px;
-                border-radius: 50%;
-                margin-right: 6px;
-            }}
-            .close {{ background-color: #FF5F56; }}
-            .minimize {{ background-color: #FFBD2E; }}
-            .maximize {{ background-color: #27C93F; }}
-            .code-content {{
-                padding: 20px;
-                overflow-x: auto;
-            }}
-            pre {{
-                margin: 0;
-                white-space: pre-wrap;
-                word-wrap: break-word;
-            }}
-            code {{
-                font-family: 'SF Mono', 'Menlo', 'Monaco', 'Courier', monospace;
-                font-size: 18px;
-                line-height: 1.5;
-            }}
-            .hljs {{
-                background-color: transparent !important;
-                padding: 0 !important;
-                color: #FFFFFF;
-            }}
-            .hljs-keyword {{ color: #FF7AB2; }}
-            .hljs-string {{ color: #FF8170; }}
-            .hljs-number {{ color: #D9C97C; }}
-            .hljs-built_in {{ color: #78C2B3; }}
-            .hljs-function {{ color: #78C2B3; }}
-        </style>
-    </head>
-    <body>
-        <div class="editor-container">
-            <div class="window-controls">
-                <div class="control close"></div>
-                <div class="control minimize"></div>
-                <div class="control maximize"></div>
-            </div>
-            <div class="code-content">
-                <pre><code class="language-{language}">{code}</code></pre>
-            </div>
+    highlighted = highlight(formatted_code, resolve_lexer(language), _formatter).rstrip('\n')
+    return f'<pre><code class="language-{html.escape(language)}">{highlighted}</code></pre>'
+
+HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Code Preview</title>
+    <style>
+        body {{
+            margin: 0;
+            padding: 0;
+            background: linear-gradient(135deg, #b388ff 0%, #7c4dff 100%);
+            min-height: 100vh;
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Roboto', 'Helvetica', 'Arial', sans-serif;
+        }}
+        #shots {{
+            display: flex;
+            flex-direction: column;
+            align-items: center;
+        }}
+        .shot {{
+            padding: 20px;
+            margin: 20px;
+            background: linear-gradient(135deg, #b388ff 0%, #7c4dff 100%);
+        }}
+        .editor-container {{
+            background-color: rgba(41, 42, 48, 0.85);
+            border-radius: 12px;
+            overflow: hidden;
+            box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
+            width: 720px;
+        }}
+        .window-controls {{
+            background-color: rgba(58, 58, 58, 0.85);
+            padding: 10px;
+            display: flex;
+            align-items: center;
+        }}
+        .control {{
+            width: 12px;
+            height: 12px;
+            border-radius: 50%;
+            margin-right: 6px;
+        }}
+        .close {{ background-color: #FF5F56; }}
+        .minimize {{ background-color: #FFBD2E; }}
+        .maximize {{ background-color: #27C93F; }}
+        .code-content {{
+            padding: 20px;
+            overflow-x: auto;
+        }}
+        pre {{
+            margin: 0;
+            white-space: pre-wrap;
+            word-wrap: break-word;
+        }}
+        code {{
+            font-family: 'SF Mono', 'Menlo', 'Monaco', 'Courier', monospace;
+            font-size: 18px;
+            line-height: 1.5;
+        }}
+        {highlight_css}
+    </style>
+</head>
+<body>
+    <div id="shots">{content}</div>
+</body>
+</html>
+"""
+
+# 每个代码块一个 .shot，截图时按元素截取，外边距与原先的裁剪区域一致
+SHOT_TEMPLATE = """
+<div class="shot">
+    <div class="editor-container">
+        <div class="window-controls">
+            <div class="control close"></div>
+            <div class="control minimize"></div>
+            <div class="control maximize"></div>
         </div>
+        <div class="code-content">{content}</div>
+    </div>
+</div>
+"""
+
+VIEWPORT = {'width': 800, 'height': 600}
+DEVICE_SCALE_FACTOR = 2
+POOL_SIZE = 2
+MAX_RENDERS_PER_PAGE = 200  # 每个页面渲染这么多次后关闭重建，避免长时间运行的页面占用内存
 
-        <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/highlight.min.js"></script>
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.7.0/styles/atom-one-dark.min.css">
-        <script>hljs.highlightAll();</script>
-    </body>
-    </html>
+class BrowserPool:
     """
+    常驻浏览器和页面池
 
-    html_content = HTML_TEMPLATE.format(code=formatted_code, language=language)
+    浏览器只启动一次，页面在多次渲染（跨代码块、跨文章）之间复用。
+    取出页面时做健康检查，浏览器断开时自动重启，页面渲染 max_renders 次后回收。
+    同步版 Playwright 的对象只能在创建它的线程中使用，所以每个线程各有一个池，
+    见 get_browser_pool。
+    """
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.html') as tmp_file:
-        tmp_file.write(html_content.encode('utf-8'))
-        tmp_file_path = tmp_file.name
+    def __init__(self, size=POOL_SIZE, max_renders=MAX_RENDERS_PER_PAGE,
+                 viewport=VIEWPORT, device_scale_factor=DEVICE_SCALE_FACTOR, setup=None):
+        self.size = size
+        self.setup = setup
+        self.max_renders = max_renders
+        self.viewport = viewport
+        self.device_scale_factor = device_scale_factor
+        self._playwright = None
+        self._browser = None
+        self._idle = []
+        self._renders = {}
 
-    try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch()
-            page = browser.new_page(viewport={'width': 800, 'height': 600}, device_scale_factor=2)
-            page.goto(f'file://{tmp_file_path}')
-            page.wait_for_load_state('networkidle')
-
-            page.evaluate('() => hljs.highlightAll()')
-
-            bbox = page.evaluate('''() => {
-                const container = document.querySelector('.editor-container');
-                const rect = container.getBoundingClientRect();
-                return {
-                    x: rect.x,
-                    y: rect.y,
-                    width: rect.width,
-                    height: rect.height
-                };
-            }''')
-
-            screenshot = page.screenshot(
-                clip={
-                    'x': bbox['x'] - 20,
-                    'y': bbox['y'] - 20,
-                    'width': bbox['width'] + 40,
-                    'height': bbox['height'] + 40
-                },
-                path=None
-            )
-            browser.close()
-
-        with Image.open(io.BytesIO(screenshot)) as img:
-            img.save(save_path, format="PNG")
-
-        return True
+    def _ensure_browser(self):
+        if self._browser is not None and self._browser.is_connected():
+            return
+        if self._playwright is None:
+            self._playwright = sync_playwright().start()
+        self._browser = self._playwright.chromium.launch()
+        self._idle = []
+        self._renders = {}
+
+    def _new_page(self):
+        page = self._browser.new_page(viewport=self.viewport, device_scale_factor=self.device_scale_factor)
+        self._renders[page] = 0
+        if self.setup is not None:
+            self.setup(page)
+        return page
+
+    def _is_healthy(self, page):
+        if page.is_closed():
+            return False
+        try:
+            page.evaluate('() => true')
+            return True
+        except PlaywrightError:
+            return False
+
+    def _discard(self, page):
+        self._renders.pop(page, None)
+        try:
+            page.close()
+        except PlaywrightError:
+            pass
+
+    @contextmanager
+    def page(self):
+        """取出一个健康的页面，用完后放回池中或回收"""
+        self._ensure_browser()
+        page = None
+        while self._idle:
+            candidate = self._idle.pop()
+            if self._is_healthy(candidate):
+                page = candidate
+                break
+            self._discard(candidate)
+        if page is None:
+            page = self._new_page()
+
+        reusable = False
+        try:
+            yield page
+            reusable = True
+        finally:
+            self._renders[page] = self._renders.get(page, 0) + 1
+            if reusable and self._renders[page] < self.max_renders and len(self._idle) < self.size:
+                self._idle.append(page)
+            else:
+                self._discard(page)
+
+    def close(self):
+        try:
+            for page in self._idle:
+                self._discard(page)
+            self._idle = []
+            if self._browser is not None:
+                self._browser.close()
+            if self._playwright is not None:
+                self._playwright.stop()
+        except Exception:
+            pass
+        finally:
+            self._browser = None
+            self._playwright = None
+
+_local = threading.local()
+
+def load_shell(page):
+    """新页面只加载一次页面外壳（样式），之后每次渲染只替换代码块区域"""
+    page.set_content(SHELL_HTML)
+
+def get_browser_pool():
+    """返回当前线程的浏览器池，首次调用时创建"""
+    pool = getattr(_local, 'pool', None)
+    if pool is None:
+        pool = _local.pool = BrowserPool(setup=load_shell)
+        atexit.register(pool.close)
+    return pool
+
+def build_shots(blocks, max_width=80):
+    return ''.join(SHOT_TEMPLATE.format(content=highlight_code(code, language, max_width))
+                   for code, language in blocks)
+
+def build_html(code, language, max_width=80):
+    """生成完整的独立页面，便于调试时直接在浏览器中打开"""
+    return HTML_TEMPLATE.format(highlight_css=HIGHLIGHT_CSS, content=build_shots([(code, language)], max_width))
+
+SHELL_HTML = HTML_TEMPLATE.format(highlight_css=HIGHLIGHT_CSS, content='')
+
+def screenshot_shots(page, shots_html):
+    """把所有代码块一次性放进页面，逐个截取 .shot 元素，返回 PNG 字节列表"""
+    page.evaluate("html => { document.getElementById('shots').innerHTML = html; }", shots_html)
+    return [shot.screenshot() for shot in page.query_selector_all('.shot')]
+
+def render_batch_with_browser(blocks, max_width=80):
+    """
+    在同一个页面中渲染一篇文章的所有代码块，导航和布局只发生一次
+
+    :param blocks: (code, language) 列表
+    :return: 与 blocks 一一对应的 PIL 图片列表
+    """
+    if not blocks:
+        return []
+    with get_browser_pool().page() as page:
+        screenshots = screenshot_shots(page, build_shots(blocks, max_width))
+    return [Image.open(io.BytesIO(screenshot)) for screenshot in screenshots]
+
+def render_with_browser(code, language, max_width=80):
+    return render_batch_with_browser([(code, language)], max_width)[0]
+
+class AsyncBrowserPool:
+    """
+    异步渲染用的常驻浏览器
+
+    在一个专用的后台线程上运行自己的事件循环，浏览器和页面都属于这个循环，
+    所以无论调用方线程里有没有正在运行的事件循环（同步版 Playwright 会占用一个）都可以提交任务。
+    浏览器只启动一次，页面在多次渲染之间复用，健康检查和回收方式与 BrowserPool 相同。
+    """
+
+    def __init__(self, size=CONCURRENCY, max_renders=MAX_RENDERS_PER_PAGE,
+                 viewport=VIEWPORT, device_scale_factor=DEVICE_SCALE_FACTOR):
+        self.size = size
+        self.max_renders = max_renders
+        self.viewport = viewport
+        self.device_scale_factor = device_scale_factor
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._playwright = None
+        self._browser = None
+        self._browser_lock = None
+        self._idle = []
+        self._renders = {}
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._loop = asyncio.new_event_loop()
+            self._browser_lock = asyncio.Lock()
+            self._thread = threading.Thread(target=self._loop.run_forever, name='async-browser', daemon=True)
+            self._thread.start()
+
+    def submit(self, coro):
+        """把协程交给后台事件循环执行，返回 concurrent.futures.Future"""
+        self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro):
+        """在后台事件循环上执行协程并等待结果，不能在后台线程自身中调用"""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("AsyncBrowserPool.run called from its own event loop")
+        return self.submit(coro).result()
+
+    async def _ensure_browser(self):
+        async with self._browser_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch()
+            self._idle = []
+            self._renders = {}
+
+    async def _new_page(self):
+        page = await self._browser.new_page(viewport=self.viewport, device_scale_factor=self.device_scale_factor)
+        self._renders[page] = 0
+        await page.set_content(SHELL_HTML)
+        return page
+
+    async def _is_healthy(self, page):
+        if page.is_closed():
+            return False
+        try:
+            await page.evaluate('() => true')
+            return True
+        except PlaywrightError:
+            return False
+
+    async def _discard(self, page):
+        self._renders.pop(page, None)
+        try:
+            await page.close()
+        except PlaywrightError:
+            pass
+
+    async def _acquire(self):
+        await self._ensure_browser()
+        while self._idle:
+            page = self._idle.pop()
+            if await self._is_healthy(page):
+                return page
+            await self._discard(page)
+        return await self._new_page()
+
+    async def _release(self, page, reusable):
+        self._renders[page] = self._renders.get(page, 0) + 1
+        if reusable and self._renders[page] < self.max_renders and len(self._idle) < self.size:
+            self._idle.append(page)
+        else:
+            await self._discard(page)
+
+    async def _render_group(self, blocks, max_width):
+        page = await self._acquire()
+        reusable = False
+        try:
+            await page.evaluate("html => { document.getElementById('shots').innerHTML = html; }",
+                                build_shots(blocks, max_width))
+            screenshots = [await shot.screenshot() for shot in await page.query_selector_all('.shot')]
+            reusable = True
+        finally:
+            await self._release(page, reusable)
+        return [Image.open(io.BytesIO(screenshot)) for screenshot in screenshots]
+
+    async def render(self, blocks, max_width=80, concurrency=None):
+        """
+        把代码块轮流分到最多 concurrency 组，每组在一个页面中批量渲染，各组并发
+
+        :param blocks: (code, language) 列表
+        :return: 与 blocks 一一对应的 PIL 图片，失败的位置为异常对象
+        """
+        groups = min(concurrency or self.size, len(blocks))
+        indexes = [list(range(i, len(blocks), groups)) for i in range(groups)]
+        results = await asyncio.gather(*(
+            self._render_group([blocks[i] for i in group], max_width) for group in indexes
+        ), return_exceptions=True)
+
+        images = [None] * len(blocks)
+        for group, result in zip(indexes, results):
+            for position, i in enumerate(group):
+                images[i] = result if isinstance(result, BaseException) else result[position]
+        return images
+
+    async def _close(self):
+        for page in self._idle:
+            await self._discard(page)
+        self._idle = []
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+
+    def close(self):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self.submit(self._close()).result(timeout=10)
+        except Exception:
+            pass
+        finally:
+            self._browser = None
+            self._playwright = None
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+_async_pool = None
+_async_pool_lock = threading.Lock()
+
+def get_async_browser_pool():
+    """返回进程内共享的异步浏览器池，首次调用时创建"""
+    global _async_pool
+    with _async_pool_lock:
+        if _async_pool is None:
+            _async_pool = AsyncBrowserPool()
+            atexit.register(_async_pool.close)
+        return _async_pool
+
+async def render_async_with_browser(blocks, max_width=80, concurrency=CONCURRENCY):
+    """
+    异步渲染：代码块分成最多 concurrency 组，每组一个页面，总耗时接近最慢的那一组
+
+    渲染在 get_async_browser_pool 的后台事件循环上执行，可以在任意事件循环中 await。
+
+    :param blocks: (code, language) 列表
+    :return: 与 blocks 一一对应的 PIL 图片，失败的位置为异常对象
+    """
+    if not blocks:
+        return []
+    pool = get_async_browser_pool()
+    return await asyncio.wrap_future(pool.submit(pool.render(blocks, max_width, concurrency)))
+
+# Pillow 后端的布局，与 HTML 模板一致（CSS 像素，绘制时乘以 scale）
+OUTER_MARGIN = 20
+CONTAINER_WIDTH = 720
+CONTAINER_RADIUS = 12
+CONTROLS_HEIGHT = 32
+CONTENT_PADDING = 20
+CODE_FONT_SIZE = 18
+CODE_LINE_HEIGHT = 27
+TAB_SIZE = 8
+GRADIENT_COLORS = ((0xb3, 0x88, 0xff), (0x7c, 0x4d, 0xff))
+CONTAINER_COLOR = (41, 42, 48, 217)
+CONTROLS_COLOR = (58, 58, 58, 217)
+CONTROL_COLORS = ('#FF5F56', '#FFBD2E', '#27C93F')
+
+FONT_CANDIDATES = [
+    '/System/Library/Fonts/SFNSMono.ttf',
+    '/System/Library/Fonts/Menlo.ttc',
+    'C:/Windows/Fonts/consola.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSansMono.ttf',
+    '/usr/share/fonts/truetype/liberation/LiberationMono-Regular.ttf',
+]
+CJK_FONT_CANDIDATES = [
+    '/System/Library/Fonts/PingFang.ttc',
+    'C:/Windows/Fonts/msyh.ttc',
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',
+]
+
+_fonts = {}
+
+def find_font(candidates, configured=None):
+    """返回第一个存在的字体文件路径，都不存在时返回 None"""
+    for path in ([configured] if configured else []) + candidates:
+        if path and os.path.exists(path):
+            return path
+    return None
+
+def load_font(size, candidates, configured=None):
+    key = (size, configured, tuple(candidates))
+    if key not in _fonts:
+        path = find_font(candidates, configured)
+        _fonts[key] = ImageFont.truetype(path, size) if path else None
+    return _fonts[key]
+
+def token_color(ttype):
+    color = EditorStyle.style_for_token(ttype)['color']
+    return f'#{color}' if color else '#FFFFFF'
+
+def layout_tokens(code, language, max_width, font, cjk_font, line_width):
+    """
+    把高亮后的 token 排成行，超出宽度时按字符换行（对应 pre-wrap）
 
+    :return: 行列表，每行是 [文本, 颜色, 字体, x] 的片段列表，相邻同色同字体的字符合并为一段
+    """
+    lines = [[]]
+    x = 0
+    formatted_code = format_code(code, max_width).expandtabs(TAB_SIZE)
+    for ttype, value in resolve_lexer(language).get_tokens(formatted_code):
+        color = token_color(ttype)
+        for index, part in enumerate(value.split('\n')):
+            if index:
+                lines.append([])
+                x = 0
+            for char in part:
+                char_font = cjk_font if cjk_font and ord(char) >= 0x2E80 else font
+                advance = char_font.getlength(char)
+                if x + advance > line_width and x > 0:
+                    lines.append([])
+                    x = 0
+                line = lines[-1]
+                if line and line[-1][1] == color and line[-1][2] is char_font:
+                    line[-1][0] += char
+                else:
+                    line.append([char, color, char_font, x])
+                x += advance
+    while lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+def gradient(size, shrink=8):
+    # 线性渐变在低分辨率下计算后双线性放大，结果几乎一致
+    width, height = size
+    small_width, small_height = max(width // shrink, 2), max(height // shrink, 2)
+    weight = (np.arange(small_width)[None, :] + np.arange(small_height)[:, None]) / (small_width + small_height - 2)
+    start, end = (np.array(c, dtype=np.float64) for c in GRADIENT_COLORS)
+    pixels = start + (end - start) * weight[..., None]
+    small = Image.fromarray(pixels.astype(np.uint8), 'RGB')
+    return small.resize(size, Image.BILINEAR)
+
+def render_with_pillow(code, language, max_width=80, scale=DEVICE_SCALE_FACTOR):
+    """
+    不依赖浏览器的代码图片渲染：Pygments 切分 token，Pillow 绘制窗口、渐变背景和代码
+
+    :return: PIL 图片
+    """
+    font = load_font(CODE_FONT_SIZE * scale, FONT_CANDIDATES, CODE_IMAGE_CONFIG.get('font'))
+    if font is None:
+        font = ImageFont.load_default(CODE_FONT_SIZE * scale)
+    cjk_font = load_font(CODE_FONT_SIZE * scale, CJK_FONT_CANDIDATES, CODE_IMAGE_CONFIG.get('cjk_font'))
+
+    line_width = (CONTAINER_WIDTH - 2 * CONTENT_PADDING) * scale
+    lines = layout_tokens(code, language, max_width, font, cjk_font, line_width)
+
+    container_width = CONTAINER_WIDTH * scale
+    container_height = (CONTROLS_HEIGHT + 2 * CONTENT_PADDING + CODE_LINE_HEIGHT * max(len(lines), 1)) * scale
+    margin = OUTER_MARGIN * scale
+    canvas = gradient((container_width + 2 * margin, container_height + 2 * margin))
+
+    # 阴影：在 1/4 分辨率上模糊后放大，效果接近 box-shadow 且开销很小
+    shrink = 4
+    shadow = Image.new('L', (canvas.width // shrink, canvas.height // shrink), 0)
+    ImageDraw.Draw(shadow).rounded_rectangle(
+        (margin // shrink, (margin + 20 * scale) // shrink,
+         (margin + container_width) // shrink, (margin + container_height + 20 * scale) // shrink),
+        radius=CONTAINER_RADIUS * scale // shrink, fill=77)
+    shadow = shadow.filter(ImageFilter.GaussianBlur(30 * scale // shrink)).resize(canvas.size, Image.BILINEAR)
+    canvas.paste((0, 0, 0), mask=shadow)
+
+    # 半透明的窗口和标题栏直接用带透明度的蒙版叠加在 RGB 画布上
+    mask = Image.new('L', (container_width, container_height), 0)
+    ImageDraw.Draw(mask).rounded_rectangle((0, 0, container_width - 1, container_height - 1),
+                                           radius=CONTAINER_RADIUS * scale, fill=CONTAINER_COLOR[3])
+    canvas.paste(CONTAINER_COLOR[:3], (margin, margin, margin + container_width, margin + container_height), mask)
+    controls_mask = mask.crop((0, 0, container_width, CONTROLS_HEIGHT * scale))
+    controls_mask = controls_mask.point(lambda value: value * CONTROLS_COLOR[3] // 255)
+    canvas.paste(CONTROLS_COLOR[:3], (margin, margin, margin + container_width, margin + CONTROLS_HEIGHT * scale),
+                 controls_mask)
+
+    draw = ImageDraw.Draw(canvas)
+    for index, color in enumerate(CONTROL_COLORS):
+        left = margin + (10 + index * 18) * scale
+        top = margin + 10 * scale
+        draw.ellipse((left, top, left + 12 * scale, top + 12 * scale), fill=color)
+
+    text_left = margin + CONTENT_PADDING * scale
+    text_top = margin + (CONTROLS_HEIGHT + CONTENT_PADDING) * scale
+    for row, line in enumerate(lines):
+        baseline = text_top + row * CODE_LINE_HEIGHT * scale + CODE_LINE_HEIGHT * scale // 2
+        for text, color, char_font, x in line:
+            draw.text((text_left + x, baseline), text, fill=color, font=char_font, anchor='lm')
+
+    return canvas
+
+RENDERERS = {
+    'browser': render_with_browser,
+    'pillow': render_with_pillow,
+}
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=CODE_IMAGE_CONFIG.get('workers'))
+        return _process_pool
+
+def render_batch_with_pillow(blocks, max_width=80):
+    """Pillow 后端不依赖浏览器，多个代码块在工作进程中并行渲染"""
+    if len(blocks) < 2:
+        return [render_with_pillow(code, language, max_width) for code, language in blocks]
+    codes, languages = zip(*blocks)
+    return list(get_process_pool().map(render_with_pillow, codes, languages, [max_width] * len(blocks)))
+
+BATCH_RENDERERS = {
+    'browser': render_batch_with_browser,
+    'pillow': render_batch_with_pillow,
+}
+
+# 输出选项。微信图文内的图片（uploadimg）只接受 jpg/png，webp 只适合其他发布渠道
+OUTPUT_FORMAT = CODE_IMAGE_CONFIG.get('format', 'png')  # png、jpeg 或 webp
+PALETTE_COLORS = CODE_IMAGE_CONFIG.get('palette_colors', 64)  # PNG 调色板颜色数，0 表示不量化
+COMPRESS_LEVEL = CODE_IMAGE_CONFIG.get('compress_level', 9)
+LOSSY_QUALITY = CODE_IMAGE_CONFIG.get('quality', 90)
+SCALE = CODE_IMAGE_CONFIG.get('scale', 'auto')
+# 自动缩放：(最大行数, 缩放)，代码越长缩放越小，1x 下 18px 的代码依然清晰
+SCALE_STEPS = [(40, 2), (100, 1.5), (float('inf'), 1)]
+FORMAT_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+def choose_scale(code, max_width=80):
+    if SCALE != 'auto':
+        return float(SCALE)
+    line_count = format_code(code, max_width).count('\n') + 1
+    for max_lines, scale in SCALE_STEPS:
+        if line_count <= max_lines:
+            return scale
+
+def encode_code_image(img, scale=DEVICE_SCALE_FACTOR, output_format=OUTPUT_FORMAT):
+    """
+    按输出选项编码代码图片；渲染器统一按 DEVICE_SCALE_FACTOR 出图，这里再缩放到目标倍数
+
+    :return: 编码后的字节
+    """
+    img = img.convert('RGB')
+    if scale < DEVICE_SCALE_FACTOR:
+        size = (round(img.width * scale / DEVICE_SCALE_FACTOR), round(img.height * scale / DEVICE_SCALE_FACTOR))
+        img = img.resize(size, Image.LANCZOS)
+
+    output = io.BytesIO()
+    if output_format == 'png':
+        # 代码图片颜色很少，调色板 PNG 体积通常只有 RGB 的四分之一
+        if PALETTE_COLORS:
+            img = img.quantize(PALETTE_COLORS, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+        img.save(output, format='PNG', compress_level=COMPRESS_LEVEL)
+    elif output_format == 'jpeg':
+        # 关闭色度抽样，避免彩色文字边缘发虚
+        img.save(output, format='JPEG', quality=LOSSY_QUALITY, subsampling=0, optimize=True)
+    elif output_format == 'webp':
+        img.save(output, format='WEBP', quality=LOSSY_QUALITY)
+    else:
+        raise ValueError(f"Unsupported code image format: {output_format}")
+    return output.getvalue()
+
+@lru_cache(maxsize=None)
+def theme_fingerprint(backend):
+    """
+    决定图片外观的全部参数的哈希：高亮配色、页面模板或 Pillow 布局常量、实际使用的字体
+
+    修改其中任何一项都会得到新的缓存键，旧图片不会再被使用。
+    """
+    if backend == 'browser':
+        parts = [HTML_TEMPLATE, SHOT_TEMPLATE, repr(VIEWPORT)]
+    else:
+        parts = [repr((OUTER_MARGIN, CONTAINER_WIDTH, CONTAINER_RADIUS, CONTROLS_HEIGHT, CONTENT_PADDING,
+                       CODE_FONT_SIZE, CODE_LINE_HEIGHT, TAB_SIZE, GRADIENT_COLORS, CONTAINER_COLOR,
+                       CONTROLS_COLOR, CONTROL_COLORS)),
+                 str(find_font(FONT_CANDIDATES, CODE_IMAGE_CONFIG.get('font'))),
+                 str(find_font(CJK_FONT_CANDIDATES, CODE_IMAGE_CONFIG.get('cjk_font')))]
+    parts = [backend, THEME_NAME, HIGHLIGHT_CSS, str(DEVICE_SCALE_FACTOR)] + parts
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+def code_image_key(code, language, max_width=80, backend=None):
+    """按 (代码, 语言, 主题指纹, 宽度, 缩放, 输出格式) 计算内容哈希，相同的代码块总是得到相同的图片"""
+    output = f"{OUTPUT_FORMAT}/{PALETTE_COLORS}/{LOSSY_QUALITY}"
+    parts = [code, language, theme_fingerprint(backend or CODE_IMAGE_BACKEND),
+             f"{CONTAINER_WIDTH}/{max_width}", str(choose_scale(code, max_width)), output]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+def code_image_name(code, language, max_width=80, backend=None):
+    """由内容派生的文件名，稳定且不会冲突"""
+    safe_language = re.sub(r'[^\w+-]', '', language) or 'text'
+    extension = FORMAT_EXTENSIONS[OUTPUT_FORMAT]
+    return f"{code_image_key(code, language, max_width, backend)[:16]}_{safe_language}.{extension}"
+
+def cache_path_for(code, language, max_width=80, backend=None):
+    key = code_image_key(code, language, max_width, backend)
+    return os.path.join(CODE_CACHE_DIR, key[:2], f"{key}.{FORMAT_EXTENSIONS[OUTPUT_FORMAT]}")
+
+def store_in_cache(img, cache_path, scale=DEVICE_SCALE_FACTOR):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with img:
+        data = encode_code_image(img, scale)
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, cache_path)
+
+def cached_code_images(blocks, max_width=80, backend=None):
+    """
+    批量获取代码图片的缓存路径；未命中的代码块一起渲染（浏览器后端只用一个页面）
+
+    :param blocks: (code, language) 列表
+    :return: 与 blocks 一一对应的缓存路径，渲染失败的为 None
+    """
+    paths = [cache_path_for(code, language, max_width, backend) for code, language in blocks]
+    missing = {}
+    for block, path in zip(blocks, paths):
+        if not os.path.exists(path):
+            missing.setdefault(path, block)
+    if not missing:
+        return paths
+
+    try:
+        images = BATCH_RENDERERS[backend or CODE_IMAGE_BACKEND](list(missing.values()), max_width)
+        for (path, (code, _)), img in zip(missing.items(), images):
+            store_in_cache(img, path, choose_scale(code, max_width))
     except Exception as e:
         print(f"An error occurred: {e}")
+
+    return [path if os.path.exists(path) else None for path in paths]
+
+def cached_code_image(code, language, max_width=80, backend=None):
+    """
+    返回缓存中的代码图片路径，未命中时渲染后写入缓存
+
+    :return: 缓存文件路径，渲染失败时返回 None
+    """
+    return cached_code_images([(code, language)], max_width, backend)[0]
+
+def copy_from_cache(cache_path, save_path):
+    if cache_path is None:
         return False
+    if os.path.abspath(cache_path) != os.path.abspath(save_path):
+        shutil.copyfile(cache_path, save_path)
+    return True
+
+def code_to_png(code, language, save_path, max_width=80, backend=None):
+    return copy_from_cache(cached_code_image(code, language, max_width, backend), save_path)
+
+def codes_to_png(blocks, save_paths, max_width=80, backend=None):
+    """
+    批量版 code_to_png：一篇文章的所有代码块一次渲染
+
+    :param blocks: (code, language) 列表
+    :param save_paths: 对应的保存路径
+    :return: 每个代码块是否成功
+    """
+    cache_paths = cached_code_images(blocks, max_width, backend)
+    return [copy_from_cache(cache_path, save_path) for cache_path, save_path in zip(cache_paths, save_paths)]
+
+async def cached_code_images_async(blocks, max_width=80, backend=None, concurrency=CONCURRENCY):
+    """cached_code_images 的异步版本，未命中的代码块并发渲染"""
+    backend = backend or CODE_IMAGE_BACKEND
+    paths = [cache_path_for(code, language, max_width, backend) for code, language in blocks]
+    missing = {}
+    for block, path in zip(blocks, paths):
+        if not os.path.exists(path):
+            missing.setdefault(path, block)
+
+    if missing:
+        if backend == 'browser':
+            images = await render_async_with_browser(list(missing.values()), max_width, concurrency)
+        else:
+            loop = asyncio.get_running_loop()
+            images = await asyncio.gather(*(
+                loop.run_in_executor(get_process_pool(), render_with_pillow, code, language, max_width)
+                for code, language in missing.values()
+            ), return_exceptions=True)
+
+        for path, img in zip(missing, images):
+            if isinstance(img, BaseException):
+                print(f"An error occurred: {img}")
+                continue
+            store_in_cache(img, path, choose_scale(missing[path][0], max_width))
+
+    return [path if os.path.exists(path) else None for path in paths]
+
+async def codes_to_png_async(blocks, save_paths, max_width=80, backend=None, concurrency=CONCURRENCY):
+    cache_paths = await cached_code_images_async(blocks, max_width, backend, concurrency)
+    return [copy_from_cache(cache_path, save_path) for cache_path, save_path in zip(cache_paths, save_paths)]
+
+def render_code_blocks(blocks, save_paths, max_width=80, backend=None):
+    """
+    渲染一篇文章的所有代码块：并发数大于 1 时走异步路径，否则单页面批量渲染
+
+    异步路径在 get_async_browser_pool 的后台事件循环上执行，不调用 asyncio.run，
+    调用方线程里已经有运行中的事件循环（例如同步版 Playwright 的浏览器池）时也能使用。
+
+    :return: 每个代码块是否成功
+    """
+    if CONCURRENCY > 1 and len(blocks) > 1:
+        try:
+            return get_async_browser_pool().run(codes_to_png_async(blocks, save_paths, max_width, backend))
+        except Exception as e:
+            print(f"Async rendering failed, falling back to batch rendering: {e}")
+    return codes_to_png(blocks, save_paths, max_width, backend)
 
-    finally:
-        os.unlink(tmp_file_path)
-        
 if __name__ == "__main__":
     code = """
 func NewSimpleClient(addr string, interval int, logger fklog.FKLogI) *SimpleClient {
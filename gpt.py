@@ -4,7 +4,7 @@ import re
 import yaml
 from datetime import datetime
 from openai import OpenAI
-from get_code import code_to_png
+from get_code import CODE_BLOCK_MODE, render_code_blocks, code_image_name
 from trending import view_weibo_trending, view_zhihu_trending, view_toutiao_trending
 
 def load_config():
@@ -70,7 +70,17 @@ def generate_alt_text_with_gpt(client, code, language):
     return response.choices[0].message.content.strip()
 
 def process_code_blocks(client, content, article_dir):
-    def replace_code_block(match):
+    # inline 模式下代码块原样保留，发布时由 md.WxRenderer 输出内联样式的高亮代码
+    if CODE_BLOCK_MODE == 'inline':
+        return content
+
+    pattern = r'```(\w+)?\n([\s\S]+?)\n```\s*(<!-- alt: .*? -->)?'
+    image_dir = os.path.join(article_dir, 'code_images')
+    os.makedirs(image_dir, exist_ok=True)
+
+    # 先收集所有代码块，再并发渲染，最后统一替换
+    blocks = []
+    for match in re.finditer(pattern, content):
         language = match.group(1) or "text"
         code = match.group(2)
         alt_text_match = re.search(r'<!-- alt: (.*?) -->', match.group(0))
@@ -80,22 +90,30 @@ def process_code_blocks(client, content, article_dir):
         else:
             alt_text = generate_alt_text_with_gpt(client, code, language)
         
-        image_filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{language}.png"
-        image_dir = os.path.join(article_dir, 'code_images')
-        os.makedirs(image_dir, exist_ok=True)
+        # 文件名由代码内容决定，重复保存时已有的图片直接复用
+        image_filename = code_image_name(code, language)
+        blocks.append((language, code, alt_text, image_filename))
+
+    pending = [(code, language, os.path.join(image_dir, image_filename))
+               for language, code, _, image_filename in blocks
+               if not os.path.exists(os.path.join(image_dir, image_filename))]
+    results = dict(zip(
+        [image_path for _, _, image_path in pending],
+        render_code_blocks([(code, language) for code, language, _ in pending], [image_path for _, _, image_path in pending])
+    ))
+
+    replacements = []
+    for language, code, alt_text, image_filename in blocks:
         image_path = os.path.join(image_dir, image_filename)
-        
-        success = code_to_png(code=code, language=language, save_path=image_path)
-        
-        if success:
+        if results.get(image_path, os.path.exists(image_path)):
             # 使用相对路径
             relative_image_path = os.path.join('code_images', image_filename)
-            return f"\n![{alt_text}]({relative_image_path})\n"
+            replacements.append(f"\n![{alt_text}]({relative_image_path})\n")
         else:
-            return f"\n```{language}\n{code}\n```\n<!-- alt: {alt_text} -->\n"
+            replacements.append(f"\n```{language}\n{code}\n```\n<!-- alt: {alt_text} -->\n")
 
-    pattern = r'```(\w+)?\n([\s\S]+?)\n```\s*(<!-- alt: .*? -->)?'
-    return re.sub(pattern, replace_code_block, content)
+    replacement_iter = iter(replacements)
+    return re.sub(pattern, lambda match: next(replacement_iter), content)
 
 def save_article(client, title, content):
     articles_dir = 'articles'
@@ -1,92 +1,390 @@
 import re
+import copy
+import html
+import json
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping
 import markdown
-from pygments import highlight
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+from markdown.util import HTML_PLACEHOLDER_RE
+import xml.etree.ElementTree as etree
 from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter
+from pygments.lexers.special import TextLexer
+from pygments.styles import get_style_by_name
+from pygments.util import ClassNotFound
 
 class WxRenderer:
     def __init__(self, opts):
         self.opts = opts
         self.footnotes = []
         self.footnote_index = 0
-        self.style_mapping = self.build_theme(opts['theme'])
-
-    def build_theme(self, theme_tpl):
-        mapping = {}
-        base = {**theme_tpl['BASE'], 'font-family': self.opts['fonts'], 'font-size': self.opts['size']}
-        
-        for ele, style in theme_tpl['inline'].items():
-            mapping[ele] = {**base, **style}
-        
-        base_block = {**base}
-        for ele, style in theme_tpl['block'].items():
-            mapping[ele] = {**base_block, **style}
-        
-        return mapping
+        self.theme = compile_theme(
+            opts['theme'], opts['fonts'], opts['size'],
+            color=opts.get('color'), font_size=opts.get('font_size'),
+        )
+        self._local = threading.local()
+
+    def style_for(self, token_name, addition=''):
+        return self.theme.style_for(token_name, addition)
 
     def get_styles(self, token_name, addition=''):
-        styles = self.style_mapping.get(token_name, {})
-        style_str = ';'.join([f"{k}:{v}" for k, v in styles.items()])
-        return f'style="{style_str}{addition}"'
+        return f'style="{self.style_for(token_name, addition)}"'
+
+    def engine(self):
+        """当前线程的 Markdown 实例，扩展和模式只在每个线程第一次渲染时初始化"""
+        md = getattr(self._local, 'md', None)
+        if md is None:
+            # 代码块由 style_code_block 输出内联样式，不使用 codehilite 的 class 样式（会被微信过滤）
+            md = self._local.md = markdown.Markdown(extensions=['extra', WxStyleExtension(self)])
+        return md
 
     def render(self, md_text):
-        md = markdown.Markdown(extensions=['extra', 'codehilite'])
-        html = md.convert(md_text)
-        
-        # Apply custom styling
-        html = self.apply_custom_styling(html)
-        
-        return html
-
-    def apply_custom_styling(self, html):
-        # Apply heading styles
-        for i in range(1, 5):
-            html = re.sub(f'<h{i}>(.*?)</h{i}>', lambda m: f'<h{i} {self.get_styles(f"h{i}")}>{m.group(1)}</h{i}>', html)
-        
-        # Apply paragraph styles
-        html = re.sub('<p>(.*?)</p>', lambda m: f'<p {self.get_styles("p")}>{m.group(1)}</p>', html)
-        
-        # Apply blockquote styles
-        html = re.sub('<blockquote>(.*?)</blockquote>', lambda m: f'<blockquote {self.get_styles("blockquote")}>{m.group(1)}</blockquote>', html)
-        
-        # Apply code block styles
-        html = re.sub('<pre><code.*?>(.*?)</code></pre>', self.style_code_block, html, flags=re.DOTALL)
-        
-        # Apply inline code styles
-        html = re.sub('<code>(.*?)</code>', lambda m: f'<code {self.get_styles("codespan")}>{m.group(1)}</code>', html)
-        
-        # Apply list styles
-        html = re.sub('<ul>(.*?)</ul>', lambda m: f'<ul {self.get_styles("ul")}>{m.group(1)}</ul>', html, flags=re.DOTALL)
-        html = re.sub('<ol>(.*?)</ol>', lambda m: f'<ol {self.get_styles("ol")}>{m.group(1)}</ol>', html, flags=re.DOTALL)
-        html = re.sub('<li>(.*?)</li>', lambda m: f'<li {self.get_styles("listitem")}>{m.group(1)}</li>', html)
-        
-        # Apply image styles
-        html = re.sub('<img(.*?)>', lambda m: f'<figure {self.get_styles("figure")}><img{m.group(1)} {self.get_styles("image")}/></figure>', html)
-        
-        # Apply link styles
-        html = re.sub('<a(.*?)>(.*?)</a>', self.style_link, html)
-        
-        return html
-
-    def style_code_block(self, match):
-        code = match.group(1)
-        lang = re.search(r'class=".*language-(\w+)"', match.group(0))
-        lang = lang.group(1) if lang else 'plaintext'
-        
-        lexer = get_lexer_by_name(lang, stripall=True)
-        formatter = HtmlFormatter(style=self.opts.get('code_theme', 'default'))
-        highlighted_code = highlight(code, lexer, formatter)
-        
-        return f'<pre {self.get_styles("code_pre")}>{highlighted_code}</pre>'
-
-    def style_link(self, match):
-        attrs, text = match.groups()
-        href = re.search(r'href="(.*?)"', attrs)
-        href = href.group(1) if href else ''
-        
+        md = self.engine()
+        # 清掉上一篇文档留下的脚注、缩写和 htmlStash
+        md.reset()
+        return md.convert(md_text)
+
+    def render_block(self, block):
+        """渲染单个顶层块，结果按 (主题, 代码主题, 块内容哈希) 缓存"""
+        key = (
+            self.theme.key,
+            self.opts.get('code_theme', 'default'),
+            hashlib.sha1(block.encode('utf-8')).hexdigest(),
+        )
+        with _block_lock:
+            rendered = _block_cache.get(key)
+            if rendered is not None:
+                _block_cache.move_to_end(key)
+                return rendered
+
+        rendered = self.render(block)
+
+        with _block_lock:
+            _block_cache[key] = rendered
+            while len(_block_cache) > BLOCK_CACHE_SIZE:
+                _block_cache.popitem(last=False)
+        return rendered
+
+    def render_incremental(self, md_text):
+        """
+        按顶层块渲染并缓存，文章只改了几行时只重新渲染改动的块
+
+        含有跨块引用（脚注、引用式链接定义、缩写）或跨空行的原始 HTML 时结果依赖整篇文档，退回整体渲染。
+        """
+        if NEEDS_FULL_RENDER_RE.search(md_text):
+            return self.render(md_text)
+        return '\n'.join(
+            rendered for rendered in map(self.render_block, split_blocks(md_text.splitlines(keepends=True)))
+            if rendered
+        )
+
+    def render_stream(self, source):
+        """
+        逐块渲染，通过生成器产出 HTML 片段
+
+        不保留整篇源文本和整篇 HTML，峰值内存由最大的块决定。
+        脚注、引用式链接定义等只能在所在的块内解析。
+
+        :param source: Markdown 文本，或按行迭代的对象（如打开的文件）
+        :return: 生成器，产出 HTML 片段，依次拼接即为完整结果
+        """
+        if isinstance(source, str):
+            source = io.StringIO(source)
+        first = True
+        for block in split_blocks(source):
+            rendered = self.render(block)
+            if not rendered:
+                continue
+            yield rendered if first else '\n' + rendered
+            first = False
+
+    def render_to(self, source, out):
+        """
+        流式渲染并直接写入 out
+
+        :param source: 同 render_stream
+        :param out: 有 write 方法的对象，如文件或 socket.makefile('w')
+        :return: 写入的字符数
+        """
+        written = 0
+        for chunk in self.render_stream(source):
+            out.write(chunk)
+            written += len(chunk)
+        return written
+
+    def style_code_block(self, code, lang=None):
+        code_theme = self.opts.get('code_theme', 'default')
+        highlighted_code = highlight_cached(code, lang, code_theme)
+
+        background_color = code_theme_styles(code_theme)[1]
+        background = f';background:{background_color}' if background_color else ''
+        return f'<pre {self.get_styles("code_pre", background)}><code {self.get_styles("code")}>{highlighted_code}</code></pre>'
+
+
+BLOCK_CACHE_SIZE = 2048
+_block_cache = OrderedDict()
+_block_lock = threading.Lock()
+
+FENCE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+LIST_ITEM_RE = re.compile(r'^ {0,3}([*+-]|\d+\.)[ \t]')
+# 空行之后仍属于上一块的行：缩进（列表续行、缩进代码）、引用、定义列表的释义
+CONTINUATION_RE = re.compile(r'^([ \t]|>|:[ \t])')
+DEFINITION_RE = re.compile(r'^:[ \t]')
+# 脚注、引用式链接定义、缩写定义，以及不是单行注释的原始 HTML 块
+NEEDS_FULL_RENDER_RE = re.compile(r'^( {0,3}\[[^\]]+\]:|\*\[[^\]]+\]:|<(?!!--.*-->\s*$))', re.MULTILINE)
+
+def split_blocks(lines):
+    """
+    把 Markdown 按行切分成可以独立渲染的顶层块
+
+    只在空行之后、顶格开始的新段落处切分；围栏代码块内部、
+    列表项之间、缩进续行都并入当前块，宁可块大一些也不改变渲染结果。
+    定义列表之后的段落要看到下一个非空行才知道是不是新的术语，在此之前先不切分。
+
+    :param lines: 带换行符的行（列表、文件对象等可迭代对象）
+    :return: 生成器，每次产出一个块的 Markdown 文本
+    """
+    block = []
+    fence = None
+    after_blank = False
+    has_definition = False
+    held = None  # 待定的切分位置：其后的段落后面跟着释义时属于同一个定义列表
+    for line in lines:
+        if fence:
+            block.append(line)
+            if line.strip().startswith(fence) and not line.strip().strip(fence[0]):
+                fence = None
+            continue
+
+        if not line.strip():
+            if block:
+                block.append(line)
+                after_blank = True
+            continue
+
+        if held is not None:
+            if DEFINITION_RE.match(line):
+                held = None
+            elif after_blank or FENCE_RE.match(line):
+                yield ''.join(block[:held]).rstrip('\n') + '\n'
+                block = block[held:]
+                has_definition = False
+                held = None
+
+        if after_blank and held is None and not CONTINUATION_RE.match(line) and not (
+            LIST_ITEM_RE.match(line) and LIST_ITEM_RE.match(block[0])
+        ):
+            if has_definition and not FENCE_RE.match(line):
+                held = len(block)
+            else:
+                yield ''.join(block).rstrip('\n') + '\n'
+                block = []
+                has_definition = False
+        after_blank = False
+
+        match = FENCE_RE.match(line)
+        if match:
+            fence = match.group(1)
+        elif DEFINITION_RE.match(line):
+            has_definition = True
+        block.append(line)
+
+    if held is not None:
+        yield ''.join(block[:held]).rstrip('\n') + '\n'
+        block = block[held:]
+    if block:
+        yield ''.join(block).rstrip('\n') + '\n'
+
+
+# 标签 -> 主题中的样式名
+TAG_STYLES = {
+    'h1': 'h1',
+    'h2': 'h2',
+    'h3': 'h3',
+    'h4': 'h4',
+    'p': 'p',
+    'blockquote': 'blockquote',
+    'ul': 'ul',
+    'ol': 'ol',
+    'li': 'listitem',
+    'strong': 'strong',
+    'table': 'table',
+    'thead': 'thead',
+    'th': 'td',
+    'td': 'td',
+    'hr': 'hr',
+    'code': 'codespan',
+    'img': 'image',
+}
+
+FENCED_CODE_RE = re.compile(r'^<pre><code(?: class="language-([^"\s]+)")?>(.*)</code></pre>\s*$', re.DOTALL)
+
+
+def is_placeholder(element):
+    return not len(element) and bool(element.text) and HTML_PLACEHOLDER_RE.fullmatch(element.text.strip()) is not None
+
+
+class WxStyleTreeprocessor(Treeprocessor):
+    """
+    在元素树上一次遍历写入内联样式
+
+    替代逐个标签的正则替换：不再反复复制整个 HTML 字符串，跨行的元素也能匹配到。
+    围栏代码块在预处理阶段就被存进 htmlStash，这里直接替换存储的 HTML。
+    """
+
+    def __init__(self, md, renderer):
+        super().__init__(md)
+        self.renderer = renderer
+
+    def run(self, root):
+        stash = self.md.htmlStash.rawHtmlBlocks
+        for i, raw in enumerate(stash):
+            match = FENCED_CODE_RE.match(raw) if isinstance(raw, str) else None
+            if match:
+                stash[i] = self.renderer.style_code_block(html.unescape(match.group(2)), match.group(1))
+
+        stack = [root]
+        while stack:
+            parent = stack.pop()
+            for index, child in enumerate(list(parent)):
+                if child.tag == 'pre' and len(child) and child[0].tag == 'code':
+                    # 缩进代码块：高亮结果以占位符形式交给 RawHtmlPostprocessor 还原
+                    placeholder = etree.Element('p')
+                    placeholder.text = self.md.htmlStash.store(self.renderer.style_code_block(html.unescape(child[0].text or '')))
+                    placeholder.tail = child.tail
+                    parent[index] = placeholder
+                    continue
+                if child.tag == 'a':
+                    self.style_link(child)
+                elif child.tag == 'img':
+                    figure = etree.Element('figure', {'style': self.renderer.style_for('figure')})
+                    figure.tail, child.tail = child.tail, None
+                    parent[index] = figure
+                    figure.append(child)
+                if child.tag == 'p' and is_placeholder(child):
+                    # 原样 HTML 的占位段落不能加属性，否则 RawHtmlPostprocessor 无法去掉外层 <p>
+                    continue
+                if child.tag in TAG_STYLES:
+                    existing = child.get('style')
+                    style = self.renderer.style_for(TAG_STYLES[child.tag])
+                    child.set('style', f'{style};{existing}' if existing else style)
+                stack.append(child)
+
+    def style_link(self, element):
+        href = element.get('href', '')
+        element.attrib.clear()
         if href.startswith('https://mp.weixin.qq.com'):
-            return f'<a href="{href}" {self.get_styles("wx_link")}>{text}</a>'
-        return f'<span {self.get_styles("link")}>{text}</span>'
+            element.set('href', href)
+            element.set('style', self.renderer.style_for('wx_link'))
+        else:
+            # 微信不允许外链，非公众号链接改为普通文本
+            element.tag = 'span'
+            element.set('style', self.renderer.style_for('link'))
+
+
+class WxStyleExtension(Extension):
+    def __init__(self, renderer, **kwargs):
+        self.renderer = renderer
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md):
+        # 在 attr_list(8)、abbr(7) 之后运行，保留它们写入的属性
+        md.treeprocessors.register(WxStyleTreeprocessor(md, self.renderer), 'wx_style', 5)
+
+def token_style(code_style, ttype):
+    """把 Pygments 的 token 样式转成内联 CSS"""
+    style = code_style.style_for_token(ttype)
+    css = []
+    if style['color']:
+        css.append(f"color:#{style['color']}")
+    if style['bgcolor']:
+        css.append(f"background:#{style['bgcolor']}")
+    if style['bold']:
+        css.append('font-weight:bold')
+    if style['italic']:
+        css.append('font-style:italic')
+    if style['underline']:
+        css.append('text-decoration:underline')
+    return ';'.join(css)
+
+@lru_cache(maxsize=128)
+def resolve_lexer(lang):
+    """
+    按语言名获取共享的 lexer 实例
+
+    未知语言直接按纯文本处理，不做内容猜测（guess_lexer 要逐个试跑所有 lexer，很慢）。
+    """
+    try:
+        return get_lexer_by_name(lang or 'text', stripall=True)
+    except ClassNotFound:
+        return TextLexer(stripall=True)
+
+@lru_cache(maxsize=None)
+def code_theme_styles(style_name):
+    """返回 ({token 类型: 内联 CSS}, 背景色)，每个代码主题只计算一次"""
+    code_style = get_style_by_name(style_name)
+    css_map = {ttype: token_style(code_style, ttype) for ttype, _ in code_style}
+    return css_map, code_style.background_color
+
+def token_css(css_map, ttype):
+    # lexer 可能产生主题里没有的子类型，沿父类型向上查找
+    while ttype not in css_map and ttype.parent is not None:
+        ttype = ttype.parent
+    return css_map.get(ttype, '')
+
+def inline_highlight(code, lexer, css_map):
+    """
+    高亮代码并输出只带内联样式的 HTML
+
+    微信会过滤 class 和 <style>，也不保证保留空白，
+    所以颜色直接写在 span 上，换行用 <br/>，空格用 &nbsp;。
+    """
+    parts = []
+    for ttype, value in lexer.get_tokens(code.expandtabs(4)):
+        css = token_css(css_map, ttype)
+        segments = []
+        for segment in value.split('\n'):
+            escaped = html.escape(segment, quote=False).replace(' ', '&nbsp;')
+            if css and segment.strip():
+                escaped = f'<span style="{css}">{escaped}</span>'
+            segments.append(escaped)
+        parts.append('<br/>'.join(segments))
+    highlighted = ''.join(parts)
+    while highlighted.endswith('<br/>'):
+        highlighted = highlighted[:-len('<br/>')]
+    return highlighted
+
+HIGHLIGHT_CACHE_SIZE = 512
+_highlight_cache = OrderedDict()
+_highlight_lock = threading.Lock()
+
+def highlight_cached(code, lang, style_name):
+    """
+    带 LRU 缓存的 inline_highlight
+
+    以 (语言, 代码哈希, 代码主题) 为键，重复渲染同一篇文章或批量渲染时不再重新切分 token。
+    """
+    key = (lang, hashlib.sha1(code.encode('utf-8')).hexdigest(), style_name)
+    with _highlight_lock:
+        highlighted = _highlight_cache.get(key)
+        if highlighted is not None:
+            _highlight_cache.move_to_end(key)
+            return highlighted
+
+    highlighted = inline_highlight(code, resolve_lexer(lang), code_theme_styles(style_name)[0])
+
+    with _highlight_lock:
+        _highlight_cache[key] = highlighted
+        while len(_highlight_cache) > HIGHLIGHT_CACHE_SIZE:
+            _highlight_cache.popitem(last=False)
+    return highlighted
 
 baseColor = "#3f3f3f"
 
@@ -162,6 +460,8 @@ theme = {
         },
         'code': {
             'margin': 0,
+            'font-size': 'inherit',
+            'line-height': 'inherit',
             'white-space': 'nowrap',
             'font-family': 'Menlo, Operator Mono, Consolas, Monaco, monospace',
         },
@@ -254,15 +554,115 @@ theme = {
     },
 }
 
+def set_theme_color(theme_tpl, color):
+    """按强调色生成主题变体，对应 tools/util.js 中的 createCustomTheme"""
+    custom_theme = copy.deepcopy(theme_tpl)
+    custom_theme['block']['h1']['border-bottom'] = f'2px solid {color}'
+    custom_theme['block']['h2']['background'] = color
+    custom_theme['block']['h3']['border-left'] = f'3px solid {color}'
+    custom_theme['block']['h4']['color'] = color
+    custom_theme['inline']['strong']['color'] = color
+    return custom_theme
+
+def set_theme_font_size(theme_tpl, font_size):
+    """按正文字号生成主题变体，对应 tools/util.js 中的 setFontSizeWithTemplate"""
+    custom_theme = copy.deepcopy(theme_tpl)
+    custom_theme['block']['h1']['font-size'] = f'{font_size * 1.14:g}px'
+    custom_theme['block']['h2']['font-size'] = f'{font_size * 1.1:g}px'
+    custom_theme['block']['h3']['font-size'] = f'{font_size:g}px'
+    custom_theme['block']['h4']['font-size'] = f'{font_size:g}px'
+    return custom_theme
+
+
+@dataclass(frozen=True)
+class CompiledTheme:
+    """预先拼好的样式字符串，渲染时按名称直接取用"""
+    key: str
+    styles: Mapping[str, str]
+
+    def style_for(self, token_name, addition=''):
+        return f'{self.styles.get(token_name, "")}{addition}'
+
+
+THEME_CACHE_SIZE = 64
+_compiled_themes = OrderedDict()
+_compiled_lock = threading.Lock()
+
+def compile_theme(theme_tpl, fonts, size, color=None, font_size=None):
+    """
+    把主题模板编译成 CompiledTheme
+
+    结果按主题内容和选项的哈希缓存，使用同一主题的渲染器共享同一个编译结果。
+
+    :param theme_tpl: 主题模板，结构同 theme
+    :param fonts: 正文字体
+    :param size: 正文字号（CSS 值，如 16px）
+    :param color: 强调色，见 set_theme_color
+    :param font_size: 标题字号基准（px 数值），见 set_theme_font_size
+    :return: CompiledTheme
+    """
+    options = {'fonts': fonts, 'size': size, 'color': color, 'font_size': font_size}
+    payload = json.dumps([theme_tpl, options], sort_keys=True, ensure_ascii=False)
+    key = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    with _compiled_lock:
+        compiled = _compiled_themes.get(key)
+        if compiled is not None:
+            _compiled_themes.move_to_end(key)
+            return compiled
+
+    if color:
+        theme_tpl = set_theme_color(theme_tpl, color)
+    if font_size:
+        theme_tpl = set_theme_font_size(theme_tpl, font_size)
+
+    base = {**theme_tpl['BASE'], 'font-family': fonts, 'font-size': size}
+    styles = {}
+    for ele, style in {**theme_tpl['inline'], **theme_tpl['block']}.items():
+        styles[ele] = ';'.join(f"{k}:{v}" for k, v in {**base, **style}.items())
+    compiled = CompiledTheme(key, MappingProxyType(styles))
+
+    with _compiled_lock:
+        compiled = _compiled_themes.setdefault(key, compiled)
+        while len(_compiled_themes) > THEME_CACHE_SIZE:
+            _compiled_themes.popitem(last=False)
+    return compiled
+
 opts = {
     'theme': theme,
     'fonts': 'Helvetica, Arial, sans-serif',
     'size': '16px',
     'code_theme': 'default',
+    'color': None,  # 强调色，如 rgba(0, 152, 116, 0.9)
+    'font_size': None,  # 标题字号基准（px），如 16
 }
 
 renderer = WxRenderer(opts)
 
+_renderers = OrderedDict()
+_renderers_lock = threading.Lock()
+
+def get_renderer(render_opts=None):
+    """
+    按渲染选项获取共享的 WxRenderer
+
+    选项相同（编译后的主题和代码主题一致）时返回同一个实例，复用各线程已初始化的 Markdown 实例。
+    """
+    render_opts = render_opts or opts
+    compiled = compile_theme(
+        render_opts['theme'], render_opts['fonts'], render_opts['size'],
+        color=render_opts.get('color'), font_size=render_opts.get('font_size'),
+    )
+    key = (compiled.key, render_opts.get('code_theme'))
+    with _renderers_lock:
+        shared = _renderers.get(key)
+        if shared is None:
+            shared = _renderers[key] = WxRenderer(render_opts)
+            while len(_renderers) > THEME_CACHE_SIZE:
+                _renderers.popitem(last=False)
+        _renderers.move_to_end(key)
+        return shared
+
 
 if __name__ == "__main__":
     import sys
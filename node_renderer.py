@@ -0,0 +1,157 @@
+import os
+import statistics
+import threading
+import time
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+from md import get_renderer, opts
+
+
+def load_config():
+    # 单独运行本模块时可以没有配置文件
+    if not os.path.exists('config.yaml'):
+        return {}
+    with open('config.yaml', 'r') as file:
+        return yaml.safe_load(file) or {}
+
+
+RENDERER_CONFIG = load_config().get('renderer', {}) or {}
+RENDERER_BACKEND = RENDERER_CONFIG.get('backend', 'python')  # python 使用 md.WxRenderer，node 使用 tools/main.js
+NODE_RENDER_URL = RENDERER_CONFIG.get('node_url', 'http://127.0.0.1:3000/render')
+CONNECT_TIMEOUT = RENDERER_CONFIG.get('connect_timeout', 2)
+READ_TIMEOUT = RENDERER_CONFIG.get('read_timeout', 10)
+POOL_SIZE = RENDERER_CONFIG.get('pool_size', 8)
+RETRY_AFTER = RENDERER_CONFIG.get('retry_after', 30)  # 服务不可用后多少秒内直接使用本地渲染
+
+
+class NodeRenderer:
+    """
+    tools/main.js 渲染服务的客户端
+
+    通过 keep-alive 连接池请求 POST /render，接口与 WxRenderer 一致；
+    服务不可用、超时或返回错误时退回 WxRenderer，并在 RETRY_AFTER 秒内不再尝试请求服务。
+    """
+
+    def __init__(self, render_opts=None, url=NODE_RENDER_URL, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 pool_size=POOL_SIZE):
+        self.opts = render_opts or opts
+        self.url = url
+        self.timeout = timeout
+        self.fallback = get_renderer(self.opts)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._down_until = 0
+
+    def payload(self, md_text):
+        payload = {'markdown': md_text}
+        if self.opts.get('color'):
+            payload['color'] = self.opts['color']
+        if self.opts.get('font_size'):
+            payload['fontSize'] = self.opts['font_size']
+        return payload
+
+    def render_remote(self, md_text):
+        """请求渲染服务，失败时抛出 requests.RequestException"""
+        response = self.session.post(self.url, json=self.payload(md_text), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['html']
+
+    def render(self, md_text):
+        with self._lock:
+            available = time.monotonic() >= self._down_until
+        if available:
+            try:
+                return self.render_remote(md_text)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                print(f"Node renderer unavailable, falling back to WxRenderer: {e}")
+                with self._lock:
+                    self._down_until = time.monotonic() + RETRY_AFTER
+        return self.fallback.render(md_text)
+
+    def render_incremental(self, md_text):
+        # 渲染服务没有块缓存，整篇提交
+        return self.render(md_text)
+
+    def close(self):
+        self.session.close()
+
+
+_node_renderers = {}
+_node_lock = threading.Lock()
+
+
+def get_article_renderer(render_opts=None):
+    """
+    按配置的 renderer.backend 获取渲染器
+
+    :param render_opts: 渲染选项，同 md.opts
+    :return: WxRenderer 或 NodeRenderer
+    """
+    render_opts = render_opts or opts
+    if RENDERER_BACKEND != 'node':
+        return get_renderer(render_opts)
+    key = (render_opts.get('color'), render_opts.get('font_size'))
+    with _node_lock:
+        if key not in _node_renderers:
+            _node_renderers[key] = NodeRenderer(render_opts)
+        return _node_renderers[key]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def benchmark(renderers, corpus, rounds=20):
+    """
+    在同一组文档上对比各渲染函数的吞吐和延迟
+
+    :param renderers: {名称: 渲染函数}，函数接收 Markdown 文本返回 HTML
+    :param corpus: Markdown 文本列表
+    :param rounds: 每篇文档渲染的次数
+    :return: {名称: {"docs_per_sec", "p50_ms", "p99_ms"}}
+    """
+    results = {}
+    for name, render in renderers.items():
+        render(corpus[0])  # 预热：建立连接、初始化 Markdown 实例
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for text in corpus:
+                begin = time.perf_counter()
+                render(text)
+                latencies.append(time.perf_counter() - begin)
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            'docs_per_sec': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(statistics.median(latencies) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    paths = sys.argv[1:] or ['tools/test.md']
+    corpus = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            corpus.append(f.read())
+
+    node = NodeRenderer()
+    try:
+        node.render_remote(corpus[0])
+    except requests.RequestException as e:
+        sys.exit(f"Node renderer is not reachable at {node.url} ({e}), start it with `node tools/main.js`")
+
+    # node 直接用 render_remote，避免服务中途失败时退回本地渲染混进结果
+    for name, result in benchmark({'python': get_renderer().render, 'node': node.render_remote}, corpus).items():
+        print(f"{name:>8}: {result['docs_per_sec']:>8} docs/s  p50 {result['p50_ms']:>8} ms  p99 {result['p99_ms']:>8} ms")
+    node.close()
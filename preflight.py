@@ -0,0 +1,389 @@
+import html
+import os
+import re
+from collections import Counter, defaultdict
+from html.parser import HTMLParser
+
+import yaml
+
+
+def load_config():
+    # 单独运行本模块时可以没有配置文件
+    if not os.path.exists('config.yaml'):
+        return {}
+    with open('config.yaml', 'r') as file:
+        return yaml.safe_load(file) or {}
+
+
+PREFLIGHT_CONFIG = load_config().get('preflight', {}) or {}
+MAX_CONTENT_CHARS = PREFLIGHT_CONFIG.get('max_chars', 20000)  # 微信要求正文少于 2 万字符
+MAX_CONTENT_BYTES = PREFLIGHT_CONFIG.get('max_bytes', 1024 * 1024)  # 且小于 1M
+MAX_IMAGES = PREFLIGHT_CONFIG.get('max_images', 100)
+
+# 微信会整段去掉的标签，连同内容一起删除
+DROPPED_TAGS = {'script', 'style', 'link', 'meta', 'noscript', 'template'}
+# 去掉之后内容也无法正常显示的标签，发布前直接报错
+FORBIDDEN_TAGS = {'iframe', 'form', 'input', 'button', 'select', 'textarea', 'object', 'embed', 'frame', 'frameset'}
+VOID_TAGS = {'area', 'br', 'col', 'hr', 'img', 'input', 'source', 'wbr', 'embed', 'link', 'meta'}
+BLOCK_TAGS = {
+    'p', 'div', 'section', 'blockquote', 'pre', 'ul', 'ol', 'li', 'table', 'thead', 'tbody', 'tr',
+    'th', 'td', 'figure', 'figcaption', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'dl', 'dt', 'dd',
+}
+# 微信不使用或会过滤的属性
+DROPPED_ATTRS = {'class', 'id'}
+# 会被子元素继承的属性，与父元素相同的声明可以省掉
+INHERITED_PROPERTIES = {
+    'color', 'font-family', 'font-size', 'font-style', 'font-weight', 'letter-spacing',
+    'line-height', 'text-align', 'white-space', 'word-break',
+}
+# text-align 只对块级元素生效，行内元素上的声明是多余的
+INLINE_TAGS = {'a', 'b', 'code', 'em', 'i', 'span', 'strong', 'sub', 'sup'}
+# 只能包含子元素、不能直接包含文字的标签，其中的空白文本不会显示
+NO_TEXT_TAGS = {'ul', 'ol', 'dl', 'table', 'thead', 'tbody', 'tfoot', 'tr'}
+RELATIVE_VALUE_RE = re.compile(r'\d(em|rem|ex|ch|%)\b|^(larger|smaller|bolder|lighter)$')
+# HTML 的空白字符，不含 \xa0 等 Unicode 空白
+WHITESPACE_RE = re.compile(r'[ \t\n\r\f]+')
+
+
+class PreflightError(Exception):
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("Preflight check failed: " + "; ".join(problems))
+
+
+def parse_style(style):
+    """解析 style 属性，同名属性保留最后一个"""
+    declarations = {}
+    for declaration in style.split(';'):
+        name, sep, value = declaration.partition(':')
+        if sep and name.strip() and value.strip():
+            name = name.strip().lower()
+            declarations.pop(name, None)
+            declarations[name] = value.strip()
+    return declarations
+
+
+class TopLevelScan(HTMLParser):
+    """统计顶层元素的样式声明，找出可以提到外层 <section> 的公共样式"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.depth = 0
+        self.count = 0
+        self.declared = Counter()
+        self.values = defaultdict(Counter)
+        self.relative = set()
+        self.loose_text = False
+
+    def record(self, attrs):
+        self.count += 1
+        for name, value in parse_style(dict(attrs).get('style') or '').items():
+            self.declared[name] += 1
+            if name not in INHERITED_PROPERTIES:
+                continue
+            if RELATIVE_VALUE_RE.search(value) or value == 'inherit':
+                self.relative.add(name)
+            else:
+                self.values[name][value] += 1
+
+    def handle_starttag(self, tag, attrs):
+        if self.depth == 0:
+            self.record(attrs)
+        if tag not in VOID_TAGS:
+            self.depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self.depth == 0:
+            self.record(attrs)
+
+    def handle_endtag(self, tag):
+        if tag not in VOID_TAGS:
+            self.depth = max(self.depth - 1, 0)
+
+    def handle_data(self, data):
+        if self.depth == 0 and data.strip():
+            self.loose_text = True
+
+    def shared_style(self):
+        """
+        每个顶层元素都声明了的可继承属性，取最常见的值
+
+        只有所有顶层元素都显式声明过的属性才能提取，
+        否则没声明的元素会从继承微信正文容器的值变成继承外层 <section> 的值；
+        有顶层元素使用相对值（如标题的 1.1em）的属性也不提取，相对值要按微信正文容器计算。
+        """
+        if self.loose_text or not self.count:
+            return {}
+        return {
+            name: values.most_common(1)[0][0]
+            for name, values in self.values.items()
+            if self.declared[name] == self.count and name not in self.relative
+        }
+
+
+class Minimizer(HTMLParser):
+    """
+    边解析边输出精简后的 HTML
+
+    - 删除与父元素继承值相同的样式声明；root 为外层 <section> 的样式，
+      为 None 时顶层元素的父元素是微信的正文容器，顶层样式全部保留
+    - 合并连续空白；只去掉不能包含文字的容器内、或两侧都是块级标签的空白，<pre> 内保持原样
+    - 删除注释、微信会过滤的标签和属性
+    """
+
+    def __init__(self, root=None):
+        super().__init__(convert_charrefs=False)
+        self.out = []
+        self.stack = []  # [(tag, 可继承样式)]
+        self.root = root
+        self.skip_depth = 0
+        self.pre_depth = 0
+        self.at_block = True  # 上一个输出是块级标签的边界（或文档开头）
+        self.pending_space = False  # 待定的空白：下一个输出也是块级边界时丢弃
+
+    def inherited(self):
+        return self.stack[-1][1] if self.stack else self.root
+
+    def minimize_style(self, tag, style):
+        parent = self.inherited()
+        declarations = parse_style(style)
+        if tag in INLINE_TAGS and 'display' not in declarations:
+            declarations.pop('text-align', None)
+        kept = []
+        inherited = dict(parent or {})
+        for name, value in declarations.items():
+            if name in INHERITED_PROPERTIES:
+                if value == 'inherit' and parent is not None:
+                    continue
+                if parent is not None and parent.get(name) == value:
+                    continue
+                if RELATIVE_VALUE_RE.search(value):
+                    # em、% 等相对值按各自元素的字号计算，子元素写同样的值结果可能不同
+                    inherited.pop(name, None)
+                else:
+                    inherited[name] = value
+            kept.append(f'{name}:{value}')
+        return ';'.join(kept), inherited
+
+    def build_tag(self, tag, attrs, close=''):
+        parts = [tag]
+        inherited = self.inherited()
+        for name, value in attrs:
+            if name in DROPPED_ATTRS or name.startswith('on'):
+                continue
+            if name == 'style':
+                value, inherited = self.minimize_style(tag, value or '')
+                if not value:
+                    continue
+            parts.append(name if value is None else f'{name}="{html.escape(value, quote=True)}"')
+        return f'<{" ".join(parts)}{close}>', inherited
+
+    def emit(self, markup, block=False):
+        if self.pending_space and not (block and self.at_block):
+            self.out.append(' ')
+        self.pending_space = False
+        self.out.append(markup)
+        self.at_block = block
+
+    def handle_starttag(self, tag, attrs):
+        if self.skip_depth or tag in DROPPED_TAGS:
+            if tag not in VOID_TAGS:
+                self.skip_depth += 1
+            return
+        if tag in VOID_TAGS:
+            self.emit(self.build_tag(tag, attrs, '/')[0], tag in BLOCK_TAGS)
+            return
+        markup, inherited = self.build_tag(tag, attrs)
+        self.emit(markup, tag in BLOCK_TAGS)
+        self.stack.append((tag, inherited if inherited is not None else {}))
+        if tag == 'pre':
+            self.pre_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self.skip_depth or tag in DROPPED_TAGS:
+            return
+        self.emit(self.build_tag(tag, attrs, '/')[0], tag in BLOCK_TAGS)
+
+    def handle_endtag(self, tag):
+        if self.skip_depth:
+            if tag not in VOID_TAGS:
+                self.skip_depth -= 1
+            return
+        if tag in VOID_TAGS or not any(open_tag == tag for open_tag, _ in self.stack):
+            return
+        while self.stack:
+            open_tag, _ = self.stack.pop()
+            if open_tag == 'pre':
+                self.pre_depth -= 1
+            self.emit(f'</{open_tag}>', open_tag in BLOCK_TAGS)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if not self.pre_depth:
+            data = WHITESPACE_RE.sub(' ', data)
+            if data == ' ':
+                # 块级标签之间的空白要看到下一个输出才知道能不能去掉
+                if not self.stack or self.stack[-1][0] not in NO_TEXT_TAGS:
+                    self.pending_space = True
+                return
+        self.emit(data)
+
+    def handle_entityref(self, name):
+        if not self.skip_depth:
+            self.emit(f'&{name};')
+
+    def handle_charref(self, name):
+        if not self.skip_depth:
+            self.emit(f'&#{name};')
+
+    def handle_comment(self, data):
+        pass
+
+    def handle_decl(self, decl):
+        pass
+
+
+class VisibleText(HTMLParser):
+    """按浏览器的空白规则提取显示出来的文字，用来确认精简前后文字没有变化"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+        self.pre_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self.skip_depth or tag in DROPPED_TAGS:
+            if tag not in VOID_TAGS:
+                self.skip_depth += 1
+            return
+        if tag in BLOCK_TAGS or tag == 'br':
+            self.parts.append('\n')
+        if tag == 'pre':
+            self.pre_depth += 1
+
+    def handle_endtag(self, tag):
+        if self.skip_depth:
+            if tag not in VOID_TAGS:
+                self.skip_depth -= 1
+            return
+        if tag in BLOCK_TAGS:
+            self.parts.append('\n')
+        if tag == 'pre':
+            self.pre_depth = max(self.pre_depth - 1, 0)
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.pre_depth:
+            # <pre> 内的空白原样显示，换成不会被合并的字符
+            self.parts.append(data.replace(' ', '\x1f').replace('\n', '\x1d'))
+        else:
+            self.parts.append(WHITESPACE_RE.sub(' ', data))
+
+    def text(self):
+        # 行首行尾的空白不显示
+        return re.sub(r' *\n[ \n]*', '\n', ''.join(self.parts)).strip(' \n')
+
+
+def visible_text(content):
+    parser = VisibleText()
+    parser.feed(content)
+    parser.close()
+    return parser.text()
+
+
+def minimize_html(content):
+    """
+    精简渲染结果，减小提交给微信的正文体积
+
+    精简后显示的文字与原文不一致时放弃精简，返回原文。
+
+    :param content: WxRenderer 输出的 HTML
+    :return: 精简后的 HTML
+    """
+    minimized = minimize_markup(content)
+    if visible_text(minimized) != visible_text(content):
+        print("Minimized HTML changes the visible text, keeping the original")
+        return content
+    return minimized
+
+
+def minimize_markup(content):
+    scan = TopLevelScan()
+    scan.feed(content)
+    scan.close()
+    # 所有顶层元素共有的样式只在外层 <section> 上写一次
+    root = scan.shared_style()
+
+    minimizer = Minimizer(root or None)
+    minimizer.feed(content)
+    minimizer.close()
+    while minimizer.stack:
+        minimizer.handle_endtag(minimizer.stack[-1][0])
+    minimized = ''.join(minimizer.out).strip()
+    if not root:
+        return minimized
+    root_style = html.escape(';'.join(f'{name}:{value}' for name, value in root.items()), quote=True)
+    return f'<section style="{root_style}">{minimized}</section>'
+
+
+class ArticleStats(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text_length = 0
+        self.images = []
+        self.forbidden = set()
+
+    def handle_starttag(self, tag, attrs):
+        if tag in FORBIDDEN_TAGS or tag in DROPPED_TAGS:
+            self.forbidden.add(tag)
+        if tag == 'img':
+            self.images.append(dict(attrs).get('src') or '')
+
+    def handle_data(self, data):
+        self.text_length += len(data.strip())
+
+
+def validate_article(content, check_sources=True):
+    """
+    发布前检查正文，不满足微信限制时抛出 PreflightError
+
+    :param content: 要提交的 HTML
+    :param check_sources: 是否检查图片地址都是已上传的网络地址（本地图片上传前检查时传 False）
+    :return: 统计信息 {"chars", "bytes", "images"}
+    """
+    stats = ArticleStats()
+    stats.feed(content)
+    stats.close()
+    size = len(content.encode('utf-8'))
+
+    problems = []
+    if stats.text_length >= MAX_CONTENT_CHARS:
+        problems.append(f"content has {stats.text_length} characters, limit is {MAX_CONTENT_CHARS}")
+    if size >= MAX_CONTENT_BYTES:
+        problems.append(f"content is {size} bytes, limit is {MAX_CONTENT_BYTES}")
+    if len(stats.images) > MAX_IMAGES:
+        problems.append(f"content has {len(stats.images)} images, limit is {MAX_IMAGES}")
+    if stats.forbidden:
+        problems.append(f"unsupported elements: {', '.join(sorted(stats.forbidden))}")
+    if check_sources:
+        local = [src for src in stats.images if not src.startswith(('http://', 'https://'))]
+        if local:
+            problems.append(f"images not uploaded: {', '.join(local[:5])}")
+
+    if problems:
+        raise PreflightError(problems)
+    return {"chars": stats.text_length, "bytes": size, "images": len(stats.images)}
+
+
+if __name__ == "__main__":
+    import sys
+    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        original = f.read()
+    minimized = minimize_html(original)
+    print(f"{len(original.encode('utf-8'))} -> {len(minimized.encode('utf-8'))} bytes")
+    print(validate_article(minimized, check_sources=False))
@@ -10,7 +10,9 @@ import os
 import json
 from PIL import Image
 from wx import WeChatAPI, PublishStatus, WeChatAPIError
-from md import WxRenderer, opts
+from md import opts
+from node_renderer import get_article_renderer
+from preflight import PreflightError, minimize_html, validate_article
 
 def read_text_file(file_path):
     with codecs.open(file_path, 'r', encoding='utf-8') as file:
@@ -59,11 +61,38 @@ def extract_title_from_markdown(content):
     ret = ret.replace("#", '')
     return ret
 
-def crop_cover_image(cover_path):
-    width = 1120
-    height = 383
-    crop_big = (0, 0, 900, 383)
-    crop_small = (920, 91, 1120, 291)  # Corrected to (920, 91, 920+200, 91+200)
+def cover_record(photo_id):
+    # 封面入库时已记录裁剪信息和主色，发布时无需再处理图片
+    if not photo_id:
+        return {}
+    from cover import read_log
+    return read_log().get(photo_id, {})
+
+def upload_cover_file(photo_id, cover_path, crop_info=None):
+    # 有源图的封面用衍生图缓存拼出 JPEG 上传，没有源图的旧封面上传原文件
+    if photo_id:
+        from cover_cache import build_upload_cover
+        try:
+            return build_upload_cover(photo_id)
+        except FileNotFoundError as e:
+            print(f"{e}, uploading {cover_path}")
+    return cover_path, crop_info
+
+def crop_box(position, size):
+    return (position[0], position[1], position[0] + size[0], position[1] + size[1])
+
+def crop_cover_image(cover_path, crop_info=None):
+    # 画布尺寸从封面文件读取，裁剪区域来自封面日志里的 crop_info
+    with Image.open(cover_path) as cover:
+        width, height = cover.size
+
+    if crop_info:
+        crop_big = crop_box(crop_info['large_cover']['position'], crop_info['large_cover']['size'])
+        crop_small = crop_box(crop_info['small_cover']['position'], crop_info['small_cover']['size'])
+    else:
+        # 没有 crop_info 的旧封面使用默认布局
+        crop_big = (0, 0, 900, 383)
+        crop_small = (920, 91, 1120, 291)
 
     # Calculate pic_crop_235_1 (for the big crop)
     x1_235 = crop_big[0] / width
@@ -86,27 +115,42 @@ def publish_article(api: WeChatAPI, article_path: str):
         base_path = os.path.dirname(article_path)
         meta, content = load_article_meta(article_path)
         
+        record = cover_record(meta['cover_image'].get('photo_id'))
+
+        # Render Markdown to HTML, themed with the cover's accent color
+        render_opts = opts
+        if record.get('accent_color'):
+            render_opts = {**opts, 'color': record['accent_color']}
+        renderer = get_article_renderer(render_opts)
+
+        # 上传任何素材之前先检查一遍，图片仍是本地路径
+        validate_article(minimize_html(renderer.render_incremental(content)), check_sources=False)
+
         # Process local images
         content = process_local_images(content, base_path, api)
         title = extract_title_from_markdown(content)
         with open('test.md', 'w') as f:
             f.write(content)
-        # Render Markdown to HTML
-        renderer = WxRenderer(opts)
-        html_content = renderer.render(content)
+
+        # 只有含图片的块需要重新渲染
+        html_content = minimize_html(renderer.render_incremental(content))
+        stats = validate_article(html_content)
+        print(f"Preflight passed: {stats['chars']} chars, {stats['bytes']} bytes, {stats['images']} images")
         
         with open('test.html', 'w') as f:
             f.write(html_content)
     
         # Upload cover image
-        cover_path = os.path.join(base_path, meta['cover_image']['url'])
+        cover_path, crop_info = upload_cover_file(meta['cover_image'].get('photo_id'),
+                                                  os.path.join(base_path, meta['cover_image']['url']),
+                                                  record.get('crop_info'))
         print("Uploading cover image...")
         cover_result = api.upload_permanent_material("image", cover_path)
         thumb_media_id = cover_result["media_id"]
         print(f"Cover image uploaded. Media ID: {thumb_media_id}")
         
         # Crop cover image
-        pic_crop_235_1, pic_crop_1_1 = crop_cover_image(cover_path)
+        pic_crop_235_1, pic_crop_1_1 = crop_cover_image(cover_path, crop_info)
         print(pic_crop_235_1, pic_crop_1_1)
         # Prepare the publishing data
         articles = [{
@@ -161,6 +205,8 @@ def publish_article(api: WeChatAPI, article_path: str):
 
         print("Max retries reached. Please check the publish status manually.")
 
+    except PreflightError as e:
+        print(f"Article rejected before publishing: {e}")
     except WeChatAPIError as e:
         print(f"WeChat API Error occurred: {e}")
     except Exception as e:
@@ -4,8 +4,8 @@ import random
 from datetime import datetime
 import json
 from typing import List, Dict, Tuple
-from cover import get_landscape_photos, get_unused_photos, update_photo_usage, read_log
-from pub import publish_article as wechat_publish_article
+from cover import get_unused_photos, update_photo_usage, read_log, start_prefetcher, choose_cover
+from pub import publish_article as wechat_publish_article, extract_title_from_markdown
 from wx import WeChatAPI
 import click
 from rich.console import Console
@@ -59,18 +59,22 @@ def create_default_meta():
         'cover_image': None
     }
 
-def select_cover_image() -> Tuple[str, str, str]:
+def select_cover_image(title: str = None, tags: List[str] = None) -> Tuple[str, str, str]:
+    prefetcher = start_prefetcher()
     unused_photos = get_unused_photos()
     if not unused_photos:
+        # 封面池完全为空（如首次运行）时等待预取线程拉取，避免同一批照片被重复请求和处理
         print("没有可用的封面图片，正在获取新图片...")
-        get_landscape_photos()
+        prefetcher.wait_for_covers()
         unused_photos = get_unused_photos()
     
     if unused_photos:
-        selected_photo_id = random.choice(unused_photos)
+        query = [title or "", *(tags or [])]
+        selected_photo_id = choose_cover(unused_photos, query)
         log_data = read_log()
         photo_data = log_data[selected_photo_id]
         update_photo_usage(selected_photo_id, "待发布")
+        prefetcher.poke()
         cover_path = photo_data['cover_path']
         cover_path = os.path.join("../../", cover_path)
         return selected_photo_id, cover_path, ""
@@ -92,7 +96,9 @@ def process_md_file(file_path):
             meta[key] = value
     
     if meta['cover_image'] is None:
-        photo_id, photo_url, relative_path = select_cover_image()
+        photo_id, photo_url, relative_path = select_cover_image(
+            extract_title_from_markdown(doc_content), meta.get('tags') or []
+        )
         if photo_id and photo_url:
             meta['cover_image'] = {
                 'photo_id': photo_id,
@@ -144,6 +150,7 @@ def process_directory(directory):
     return md_files, publishable_files
 
 def pub():
+    start_prefetcher()
     directory = "./articles"
     all_files, publishable_files = process_directory(directory)
     
@@ -425,6 +432,7 @@ def show_template_menu():
             console.print("[red]无效的选项，请重新选择[/red]")
 
 def main_menu():
+    start_prefetcher()
     while True:
         console.print(Panel.fit(
             "欢迎使用文章创作发布系统\n\n"